@@ -0,0 +1,87 @@
+"""Benchmark single threaded and parallel (by blocks) gzip compression.
+
+usage: python benchmarks/parallel_compression.py [--size MB] [--level N]
+
+AWS Lambda functions get up to 6 vCPUs (at 10240MB of memory), the speedup
+is bounded by the number of CPUs available.
+
+"""
+
+import os
+import json
+import time
+import zlib
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from lambda_proxy.compression import BLOCK_SIZE, default_codecs
+
+
+def geojson_body(size: int) -> bytes:
+    """Create a GeoJSON like body of about `size` bytes."""
+    rand = random.Random(0)
+    features = []
+    length = 0
+    while length < size:
+        feature = {
+            "type": "Feature",
+            "properties": {"id": len(features), "value": rand.random()},
+            "geometry": {
+                "type": "Point",
+                "coordinates": [rand.uniform(-180, 180), rand.uniform(-90, 90)],
+            },
+        }
+        features.append(feature)
+        length += 150
+
+    return json.dumps({"type": "FeatureCollection", "features": features}).encode()
+
+
+def timeit(func, repeat: int = 5) -> float:
+    """Return the best run time (in seconds)."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=float, default=5, help="body size in MB")
+    parser.add_argument("--level", type=int, default=6, help="compression level")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    args = parser.parse_args()
+
+    body = geojson_body(int(args.size * 1024 * 1024))
+    codec = default_codecs["gzip"]
+
+    reference = codec.compress(body, args.level)
+    serial = timeit(lambda: codec.compress(body, args.level))
+    print(f"body: {len(body)} bytes, level: {args.level}, cpus: {os.cpu_count()}")
+    print(f"single thread: {serial * 1000:.1f}ms ({len(reference)} bytes)")
+
+    for workers in [1, 2, 4, 6]:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            compressed = codec.parallel_compress(
+                body, args.level, executor, args.block_size
+            )
+            assert zlib.decompress(compressed, zlib.MAX_WBITS | 16) == body
+            parallel = timeit(
+                lambda: codec.parallel_compress(
+                    body, args.level, executor, args.block_size
+                )
+            )
+
+        print(
+            f"{workers} workers: {parallel * 1000:.1f}ms ({len(compressed)} bytes), "
+            f"speedup: {serial / parallel:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,73 +1,33 @@
 """Launch server"""
 
-import base64
-
 import click
-from urllib.parse import urlparse, parse_qsl
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from lambda_proxy.server import serve
 
 from handler import app
 
 
-class HTTPRequestHandler(BaseHTTPRequestHandler):
-    """Requests handler."""
-
-    def do_GET(self):
-        """Get requests."""
-        q = urlparse(self.path)
-        request = {
-            "headers": dict(self.headers),
-            "path": q.path,
-            "queryStringParameters": dict(parse_qsl(q.query)),
-            "httpMethod": self.command,
-        }
-        response = app(request, None)
-
-        self.send_response(int(response["statusCode"]))
-        for r in response["headers"]:
-            self.send_header(r, response["headers"][r])
-        self.end_headers()
-
-        if isinstance(response["body"], str):
-            self.wfile.write(bytes(response["body"], "utf-8"))
-        else:
-            self.wfile.write(response["body"])
-
-    def do_POST(self):
-        """POST requests."""
-        q = urlparse(self.path)
-        body = self.rfile.read(int(dict(self.headers).get("Content-Length")))
-        body = base64.b64encode(body).decode()
-        request = {
-            "headers": dict(self.headers),
-            "path": q.path,
-            "queryStringParameters": dict(parse_qsl(q.query)),
-            "body": body,
-            "httpMethod": self.command,
-            "isBase64Encoded": True,
-        }
-        response = app(request, None)
-
-        self.send_response(int(response["statusCode"]))
-        for r in response["headers"]:
-            self.send_header(r, response["headers"][r])
-        self.end_headers()
-
-        if isinstance(response["body"], str):
-            self.wfile.write(bytes(response["body"], "utf-8"))
-        else:
-            self.wfile.write(response["body"])
-
-
 @click.command(short_help="Local Server")
+@click.option("--host", type=str, default="127.0.0.1", help="host")
 @click.option("--port", type=int, default=8000, help="port")
-def run(port):
+@click.option("--workers", type=int, default=8, help="worker threads")
+@click.option("--queue-size", type=int, default=64, help="maximum waiting connections")
+@click.option(
+    "--event-version",
+    type=click.Choice(["1.0", "2.0"]),
+    default="1.0",
+    help="API Gateway event payload format",
+)
+def run(host, port, workers, queue_size, event_version):
     """Launch server."""
-    server_address = ("", port)
-    httpd = HTTPServer(server_address, HTTPRequestHandler)
-    click.echo(f"Starting local server at http://127.0.0.1:{port}", err=True)
-    httpd.serve_forever()
+    serve(
+        app,
+        host=host,
+        port=port,
+        workers=workers,
+        queue_size=queue_size,
+        event_version=event_version,
+    )
 
 
 if __name__ == "__main__":
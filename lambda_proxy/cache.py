@@ -0,0 +1,409 @@
+"""lambda-proxy: in-memory caches."""
+
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Size bounded Least Recently Used cache."""
+
+    def __init__(self, maxsize: int = 128) -> None:
+        """Initialize cache object."""
+        if maxsize < 1:
+            raise ValueError("Cache size must be a positive integer")
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of entries."""
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return cached value and mark it as recently used."""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Add value to the cache, evicting the least recently used entries."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+
+    def info(self) -> Dict[str, int]:
+        """Return cache statistics."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
+class MemoryCache(object):
+    """Least Recently Used cache bounded by entry count and byte size.
+
+    Entries expire after their own time to live (in seconds).
+
+    """
+
+    def __init__(self, max_entries: int = 128, max_bytes: int = 50 * 1024 * 1024):
+        """Initialize cache object."""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of entries."""
+        return len(self._data)
+
+    def _pop(self, key: Hashable) -> None:
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def get(self, key: Hashable) -> Any:
+        """Return cached value or None if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            expires = entry[2] if entry is not None else None
+            if expires is not None and expires < time.monotonic():
+                self._pop(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, size: int, ttl: float = None) -> None:
+        """Add value to the cache, evicting the least recently used entries."""
+        if size > self.max_bytes:
+            return
+
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+            self._data[key] = (value, size, expires)
+            self.bytes += size
+            while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def info(self) -> Dict[str, int]:
+        """Return cache statistics."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class ResponseCache(object):
+    """Route response cache.
+
+    Responses are keyed by route path, path arguments, the selected query
+    parameters and the response content encoding.
+
+    """
+
+    def __init__(
+        self,
+        query_params: Sequence[str] = None,
+        ttl: int = None,
+        max_entries: int = 128,
+        max_bytes: int = 50 * 1024 * 1024,
+        backend: Any = None,
+    ) -> None:
+        """Initialize response cache.
+
+        ttl: time to live in seconds, defaults to the route Cache-Control `max-age`.
+        backend: storage implementing `get(key)`, `set(key, value, size, ttl)`,
+        `clear()` and `info()`, defaults to a MemoryCache.
+
+        """
+        self.query_params = list(query_params or [])
+        self.ttl = ttl
+        self.backend = (
+            backend if backend is not None else MemoryCache(max_entries, max_bytes)
+        )
+
+    def get_key(
+        self, path: str, path_args: Dict, query_params: Dict, encoding: str = ""
+    ) -> Tuple:
+        """Return cache key for a request."""
+        return (
+            path,
+            tuple(sorted(path_args.items())),
+            tuple((name, query_params.get(name)) for name in self.query_params),
+            encoding,
+        )
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        """Return a copy of a cached response message."""
+        message = self.backend.get(key)
+        if message is None:
+            return None
+
+        return dict(message, headers=dict(message["headers"]))
+
+    def set(self, key: Tuple, message: Dict, ttl: int = None) -> None:
+        """Cache a response message."""
+        self.backend.set(key, message, len(message["body"]), ttl)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self.backend.clear()
+
+    def info(self) -> Dict[str, int]:
+        """Return cache statistics."""
+        return self.backend.info()
+
+
+class DiskCache(object):
+    """Response message cache storing bodies as files.
+
+    Bodies are written atomically to content-addressed files (named by their
+    SHA256 digest) and shared between entries with the same content. Entries
+    are evicted (LRU) when the files exceed `max_bytes`.
+
+    The entries index is kept in memory, so a directory should only be used by
+    one cache. By default a new temporary directory is created (in `/tmp` on
+    AWS Lambda).
+
+    """
+
+    def __init__(
+        self,
+        directory: str = None,
+        max_bytes: int = 512 * 1024 * 1024,
+        max_entries: int = 100000,
+    ) -> None:
+        """Initialize cache object."""
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        else:
+            directory = tempfile.mkdtemp(prefix="lambda-proxy-")
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (message without body, body digest, text body, expires)
+        self._data: OrderedDict = OrderedDict()
+        # digest -> [file size, number of entries]
+        self._files: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of entries."""
+        return len(self._data)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest)
+
+    def _pop(self, key: Hashable) -> None:
+        digest = self._data.pop(key)[1]
+        self._files[digest][1] -= 1
+        if not self._files[digest][1]:
+            self.bytes -= self._files.pop(digest)[0]
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+
+    def _write(self, digest: str, body: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, self._path(digest))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get_entry(self, key: Hashable) -> Optional[Tuple[Dict, Optional[float]]]:
+        """Return cached message and its remaining time to live."""
+        with self._lock:
+            entry = self._data.get(key)
+            expires = entry[3] if entry is not None else None
+            if expires is not None and expires < time.monotonic():
+                self._pop(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+
+        message, digest, text, expires = entry
+        try:
+            with open(self._path(digest), "rb") as f:
+                body = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+
+        ttl = expires - time.monotonic() if expires is not None else None
+        return dict(message, body=body.decode("utf-8") if text else body), ttl
+
+    def get(self, key: Hashable) -> Optional[Dict]:
+        """Return cached message or None if missing or expired."""
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def set(
+        self, key: Hashable, value: Dict, size: int = None, ttl: float = None
+    ) -> None:
+        """Add message to the cache, evicting the least recently used entries."""
+        body = value["body"]
+        text = isinstance(body, str)
+        if text:
+            body = body.encode("utf-8")
+
+        size = len(body)
+        if size > self.max_bytes:
+            return
+
+        digest = hashlib.sha256(body).hexdigest()
+        message = {k: v for k, v in value.items() if k != "body"}
+        expires = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            if digest not in self._files:
+                self._write(digest, body)
+                self._files[digest] = [size, 0]
+                self.bytes += size
+
+            # register the new entry before removing the old one so a file
+            # shared by both entries is kept.
+            self._files[digest][1] += 1
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (message, digest, text, expires)
+
+            while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all entries and files."""
+        with self._lock:
+            for key in list(self._data):
+                self._pop(key)
+
+    def info(self) -> Dict[str, int]:
+        """Return cache statistics."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "files": len(self._files),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class TieredCache(object):
+    """Two tiers response message cache.
+
+    Messages are stored on disk and, when their body is smaller than
+    `memory_item_max_bytes`, in memory. Disk hits are promoted to memory.
+
+    """
+
+    def __init__(
+        self,
+        memory: MemoryCache = None,
+        disk: DiskCache = None,
+        memory_item_max_bytes: int = 64 * 1024,
+    ) -> None:
+        """Initialize cache object."""
+        self.memory = memory if memory is not None else MemoryCache()
+        self.disk = disk if disk is not None else DiskCache()
+        self.memory_item_max_bytes = memory_item_max_bytes
+
+    def get(self, key: Hashable) -> Optional[Dict]:
+        """Return cached message from memory or disk."""
+        message = self.memory.get(key)
+        if message is not None:
+            return message
+
+        entry = self.disk.get_entry(key)
+        if entry is None:
+            return None
+
+        message, ttl = entry
+        size = len(message["body"])
+        if size <= self.memory_item_max_bytes:
+            self.memory.set(key, message, size, ttl)
+
+        return message
+
+    def set(self, key: Hashable, value: Dict, size: int, ttl: float = None) -> None:
+        """Add message to the cache."""
+        self.disk.set(key, value, size, ttl)
+        if size <= self.memory_item_max_bytes:
+            self.memory.set(key, value, size, ttl)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self.memory.clear()
+        self.disk.clear()
+
+    def info(self) -> Dict[str, Dict[str, int]]:
+        """Return cache statistics."""
+        return {"memory": self.memory.info(), "disk": self.disk.info()}
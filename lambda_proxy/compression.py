@@ -0,0 +1,196 @@
+"""lambda-proxy: response compression codecs."""
+
+from typing import Any, Callable, Dict, List, Union
+
+import sys
+import zlib
+import struct
+from concurrent.futures import Executor
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+class Codec(object):
+    """Compression codec.
+
+    name: `Content-Encoding` name of the codec.
+    compress: function compressing a body, called with `(body, level)`.
+    compressobj: optional function returning a streaming compressor (with
+    `compress(data)` and `flush()` methods), called with `(level)`.
+    parallel_compress: optional function compressing a body by blocks on an
+    executor, called with `(body, level, executor)`.
+
+    Compression levels are on the zlib scale (`0` to `9`), codecs map them to
+    their own scale.
+
+    """
+
+    def __init__(
+        self,
+        name: str,
+        compress: Callable[[bytes, int], bytes],
+        compressobj: Callable[[int], Any] = None,
+        parallel_compress: Callable[[bytes, int, Executor], bytes] = None,
+    ) -> None:
+        """Initialize codec object."""
+        self.name = name
+        self.compress = compress
+        self.compressobj = compressobj
+        self.parallel_compress = parallel_compress
+
+
+def _scale_level(level: int, min_level: int, max_level: int) -> int:
+    """Map a zlib compression level (0-9) to another codec scale."""
+    return max(min_level, round(level * max_level / 9))
+
+
+BLOCK_SIZE = 128 * 1024
+WINDOW_SIZE = 32 * 1024
+
+
+def _deflate_block(
+    body: memoryview, start: int, block_size: int, level: int, last: bool
+) -> bytes:
+    """Compress a block to raw deflate, using the previous 32kB as dictionary.
+
+    All blocks but the last end with a sync flush (byte aligned and not
+    final) so compressed blocks can be concatenated in a single stream.
+
+    """
+    end = start + block_size
+    window = max(0, start - WINDOW_SIZE)
+    zdict = body[window:start]
+    if zdict:
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict
+        )
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    data = compressor.compress(body[start:end])
+    return data + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _deflate_blocks(
+    body: Union[bytes, bytearray, memoryview],
+    level: int,
+    executor: Executor,
+    block_size: int = BLOCK_SIZE,
+) -> List[bytes]:
+    """Compress a body to raw deflate blocks on an executor."""
+    view = memoryview(body)
+    starts = range(0, max(len(view), 1), block_size)
+    last = starts[-1]
+    return list(
+        executor.map(
+            lambda start: _deflate_block(view, start, block_size, level, start == last),
+            starts,
+        )
+    )
+
+
+def parallel_deflate(
+    body: Union[bytes, bytearray, memoryview],
+    level: int,
+    executor: Executor,
+    block_size: int = BLOCK_SIZE,
+) -> bytes:
+    """Compress a body to a raw deflate stream, by blocks, on an executor.
+
+    zlib releases the GIL while compressing, so blocks are compressed in
+    parallel on a thread pool (as pigz does).
+
+    """
+    return b"".join(_deflate_blocks(body, level, executor, block_size))
+
+
+def _zlib_header(level: int) -> bytes:
+    """Return zlib stream header for a compression level."""
+    cmf = 0x78
+    flevel = 0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3
+    flg = flevel << 6
+    flg += (31 - (cmf * 256 + flg) % 31) % 31
+    return bytes([cmf, flg])
+
+
+def _zlib_codec(name: str, wbits: int) -> Codec:
+    """Create a zlib based codec."""
+
+    def compressobj(level: int) -> Any:
+        return zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(body: bytes, level: int) -> bytes:
+        # zlib.compress supports wbits since python 3.11 and avoids copying
+        # the compressed data to append the stream trailer.
+        if sys.version_info >= (3, 11):
+            return zlib.compress(body, level, wbits)
+
+        compressor = compressobj(level)
+        return b"".join([compressor.compress(body), compressor.flush()])
+
+    def parallel_compress(
+        body: bytes, level: int, executor: Executor, block_size: int = BLOCK_SIZE
+    ) -> bytes:
+        blocks = _deflate_blocks(body, level, executor, block_size)
+        if wbits < 0:
+            return b"".join(blocks)
+
+        if wbits > zlib.MAX_WBITS:
+            header = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+            size = memoryview(body).nbytes
+            trailer = struct.pack("<II", zlib.crc32(body), size & 0xFFFFFFFF)
+        else:
+            header = _zlib_header(level)
+            trailer = struct.pack(">I", zlib.adler32(body))
+
+        return b"".join([header, *blocks, trailer])
+
+    return Codec(name, compress, compressobj, parallel_compress)
+
+
+default_codecs: Dict[str, Codec] = {
+    "gzip": _zlib_codec("gzip", zlib.MAX_WBITS | 16),
+    "zlib": _zlib_codec("zlib", zlib.MAX_WBITS),
+    "deflate": _zlib_codec("deflate", -zlib.MAX_WBITS),
+}
+
+
+if brotli is not None:  # pragma: no cover
+
+    class _BrotliCompressObj(object):
+        """zlib like streaming brotli compressor."""
+
+        def __init__(self, level: int) -> None:
+            self._compressor = brotli.Compressor(quality=_scale_level(level, 0, 11))
+
+        def compress(self, data: bytes) -> bytes:
+            return self._compressor.process(data)
+
+        def flush(self) -> bytes:
+            return self._compressor.finish()
+
+    default_codecs["br"] = Codec(
+        "br",
+        lambda body, level: brotli.compress(body, quality=_scale_level(level, 0, 11)),
+        _BrotliCompressObj,
+    )
+
+
+if zstandard is not None:  # pragma: no cover
+    default_codecs["zstd"] = Codec(
+        "zstd",
+        lambda body, level: zstandard.ZstdCompressor(
+            level=_scale_level(level, 1, 19)
+        ).compress(body),
+        lambda level: zstandard.ZstdCompressor(
+            level=_scale_level(level, 1, 19)
+        ).compressobj(),
+    )
@@ -3,21 +3,42 @@
 Freely adapted from https://github.com/aws/chalice
 
 """
-from typing import Any, Callable, Dict, List, Optional, Tuple, Sequence, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Sequence,
+    Union,
+)
 
+import asyncio
 import inspect
 
 import os
 import re
 import sys
 import json
-import zlib
+import time
 import base64
+import hashlib
 import logging
 import warnings
-from functools import wraps
+import threading
+import contextvars
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, wraps
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qs
 
 from lambda_proxy import templates
+from lambda_proxy.cache import LRUCache, MemoryCache, ResponseCache
+from lambda_proxy.compression import Codec, default_codecs
 
 params_expr = re.compile(r"(<[^>]*>)")
 proxy_pattern = re.compile(r"/{(?P<name>.+)\+}$")
@@ -27,6 +48,9 @@ param_pattern = re.compile(
 regex_pattern = re.compile(
     r"^<(?P<type>regex)\((?P<pattern>.+)\):(?P<name>[a-zA-Z0-9_]+)>$"
 )
+max_age_pattern = re.compile(r"(^|,)\s*max-age=(?P<age>[0-9]+)")
+# regex tokens which might match a `/`
+slash_pattern = re.compile(r"/|\.|\[\^|\\[SWD]")
 
 
 def _path_to_regex(path: str) -> str:
@@ -58,24 +82,139 @@ def _path_to_openapi(path: str) -> str:
     return re.sub(r">", "}", path)
 
 
+def _get_converter(arg_type: Optional[str]) -> Callable:
+    """Return the function converting a path value for a parameter type."""
+    if arg_type == "int":
+        return int
+    elif arg_type == "float":
+        return float
+    else:
+        return str
+
+
 def _converters(value: str, pathArg: str) -> Any:
     match = param_pattern.match(pathArg)
     if match:
-        arg_type = match.groupdict()["type"]
-        if arg_type == "int":
-            return int(value)
-        elif arg_type == "float":
-            return float(value)
-        elif arg_type == "string":
-            return value
-        elif arg_type == "uuid":
-            return value
-        else:
-            return value
+        return _get_converter(match.groupdict()["type"])(value)
     else:
         return value
 
 
+def _to_bool(value: str) -> bool:
+    """Convert a query string value to a boolean."""
+    value = value.lower()
+    if value in ["1", "true", "yes", "on"]:
+        return True
+    elif value in ["0", "false", "no", "off"]:
+        return False
+    raise ValueError(f"invalid boolean value: '{value}'")
+
+
+_value_converters: Dict[Any, Callable] = {
+    int: int,
+    float: float,
+    bool: _to_bool,
+    str: str,
+}
+
+
+def _get_coercion(annotation: Any) -> Optional[Tuple[Callable, bool]]:
+    """Return the converter of a query string value and if it is a list."""
+    # unannotated arguments receive the query string value
+    if annotation is inspect.Parameter.empty:
+        return None
+
+    if annotation is list:
+        return str, True
+
+    # `typing.List[...]`
+    if getattr(annotation, "__origin__", None) in [list, List]:
+        item = (getattr(annotation, "__args__", None) or [str])[0]
+        return _value_converters.get(item, str), True
+
+    if annotation in [int, float, bool]:
+        return _value_converters[annotation], False
+
+    return None
+
+
+class ArgumentBinder(object):
+    """Bind request parameters to an endpoint signature."""
+
+    def __init__(self, endpoint: Callable) -> None:
+        """Inspect endpoint signature."""
+        try:
+            parameters = dict(inspect.signature(endpoint).parameters)
+            self.var_keyword = any(
+                arg.kind == inspect.Parameter.VAR_KEYWORD for arg in parameters.values()
+            )
+        except (TypeError, ValueError):
+            # signature can't be read, pass all the query parameters
+            parameters = {}
+            self.var_keyword = True
+
+        self.names = set(
+            name
+            for name, arg in parameters.items()
+            if arg.kind
+            in [inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY]
+        )
+        self.coercions: Dict[str, Tuple[Callable, bool]] = {}
+        for name in self.names:
+            coercion = _get_coercion(parameters[name].annotation)
+            if coercion is not None:
+                self.coercions[name] = coercion
+
+    def __eq__(self, other) -> bool:
+        """Check for equality."""
+        return self.__dict__ == other.__dict__
+
+    def bind(
+        self, path_args: Dict, query_params: Dict, multi_query_params: Dict = None
+    ) -> Dict:
+        """Merge query parameters accepted by the endpoint into path arguments.
+
+        Raises ValueError when a query parameter can't be converted to the type
+        of its argument.
+
+        """
+        multi_query_params = multi_query_params or {}
+        for name, value in query_params.items():
+            # path arguments are already converted
+            if name in path_args:
+                continue
+
+            if name not in self.names:
+                if self.var_keyword:
+                    path_args[name] = value
+                continue
+
+            path_args[name] = self._convert(name, value, multi_query_params)
+
+        return path_args
+
+    def _convert(self, name: str, value: Any, multi_query_params: Dict) -> Any:
+        """Convert a query parameter to the type of its argument."""
+        coercion = self.coercions.get(name)
+        if coercion is None:
+            return value
+
+        converter, is_list = coercion
+        try:
+            if is_list:
+                values = multi_query_params.get(name, value)
+                if not isinstance(values, list):
+                    values = str(values).split(",")
+                return [converter(v) for v in values]
+
+            if isinstance(value, str):
+                return converter(value)
+
+            return value
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for '{name}': {value}")
+
+
 class RouteEntry(object):
     """Decode request path."""
 
@@ -86,42 +225,286 @@ class RouteEntry(object):
         methods: List = ["GET"],
         cors: bool = False,
         token: bool = False,
-        payload_compression_method: str = "",
+        payload_compression_method: Union[str, Sequence[str]] = "",
         binary_b64encode: bool = False,
         ttl=None,
         cache_control=None,
         description: str = None,
         tag: Tuple = None,
+        cache: Union[bool, ResponseCache] = None,
+        etag: Union[bool, Callable] = False,
+        compression_level: Union[int, str] = 9,
+        codecs: Dict[str, Codec] = None,
     ) -> None:
         """Initialize route object."""
         self.endpoint = endpoint
         self.path = path
         self.route_regex = _path_to_regex(path)
+        self.route_expr = re.compile(self.route_regex)
         self.openapi_path = _path_to_openapi(self.path)
         self.methods = methods
         self.cors = cors
         self.token = token
         self.compression = payload_compression_method
+        self.compressions = _get_codecs(payload_compression_method)
         self.b64encode = binary_b64encode
         self.ttl = ttl
         self.cache_control = cache_control
         self.description = description or self.endpoint.__doc__
         self.tag = tag
-        if self.compression and self.compression not in ["gzip", "zlib", "deflate"]:
-            raise ValueError(
-                f"'{payload_compression_method}' is not a supported compression"
-            )
+        self.etag = etag
+        self.compression_level = compression_level
+        self.is_async = inspect.iscoroutinefunction(endpoint)
+        self.peak_allocation = 0
+        self.peak_response_size = 0
+        self.oversized_responses = 0
+        codecs = codecs if codecs is not None else default_codecs
+        for codec in self.compressions:
+            if codec not in codecs:
+                raise ValueError(f"'{codec}' is not a supported compression")
+
+        if compression_level != "auto" and compression_level not in range(0, 10):
+            raise ValueError(f"'{compression_level}' is not a valid compression level")
+
+        path_args = self._get_path_args()
+        self.arg_names = [arg["name"] for arg in path_args]
+        self.arg_converters = [_get_converter(arg["type"]) for arg in path_args]
+        self.binder = ArgumentBinder(endpoint)
+
+        self.cache = ResponseCache() if cache is True else cache or None
+        self.cache_ttl = None
+        if self.cache:
+            self.cache_ttl = self.cache.ttl or self._get_max_age()
+            if not self.cache_ttl:
+                raise ValueError(
+                    "Response cache needs a 'max-age' in cache_control or a cache ttl"
+                )
 
     def __eq__(self, other) -> bool:
         """Check for equality."""
         return self.__dict__ == other.__dict__
 
+    def _get_max_age(self) -> Optional[int]:
+        """Return response time to live from ttl or cache_control."""
+        if self.ttl:
+            return self.ttl
+
+        if not self.cache_control or "no-store" in self.cache_control:
+            return None
+
+        match = max_age_pattern.search(self.cache_control)
+        return int(match.group("age")) if match else None
+
     def _get_path_args(self) -> Sequence[Any]:
         route_args = [i.group() for i in params_expr.finditer(self.path)]
         args = [param_pattern.match(arg).groupdict() for arg in route_args]
         return args
 
 
+# Approximate deflate throughput (bytes per millisecond) per compression level
+_compression_throughput = {9: 10_000, 6: 30_000, 4: 50_000, 1: 100_000}
+
+
+def _get_compression_level(size: int, remaining_time: int = None) -> int:
+    """Select a compression level from body size and remaining time (in ms).
+
+    Large bodies use faster levels, and the level is lowered until the
+    estimated compression time fits in a quarter of the remaining time.
+
+    """
+    if size <= 64 * 1024:
+        level = 9
+    elif size <= 1024 * 1024:
+        level = 6
+    else:
+        level = 4
+
+    if remaining_time is None:
+        return level
+
+    for fallback in [9, 6, 4, 1]:
+        if fallback <= level and size / _compression_throughput[fallback] <= (
+            remaining_time / 4
+        ):
+            return fallback
+
+    return 1
+
+
+def _get_codecs(compression: Union[str, Sequence[str]]) -> Tuple[str, ...]:
+    """Return the compression codecs, by order of preference."""
+    if not compression:
+        return ()
+
+    if isinstance(compression, str):
+        return (compression,)
+
+    return tuple(compression)
+
+
+@lru_cache(maxsize=256)
+def _parse_accept_encoding(accepted_compression: str) -> Tuple[Tuple[str, float], ...]:
+    """Parse `Accept-Encoding` header into (coding, q-value) pairs."""
+    codings = []
+    for value in accepted_compression.lower().split(","):
+        coding, _, params = value.partition(";")
+        coding = coding.strip()
+        if not coding:
+            continue
+
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, q = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(q)
+                except ValueError:
+                    quality = 0.0
+
+        codings.append((coding, quality))
+
+    return tuple(codings)
+
+
+@lru_cache(maxsize=256)
+def _select_compression(
+    compression: Union[str, Tuple[str, ...]], accepted_compression: str
+) -> str:
+    """Return the compression to apply given the `Accept-Encoding` header.
+
+    Select the codec with the highest q-value, the route codecs order is used
+    to break ties. Codecs with `q=0` (or not accepted) are never selected.
+
+    """
+    codecs = _get_codecs(compression)
+    if not codecs or not accepted_compression:
+        return ""
+
+    accepted = dict(_parse_accept_encoding(accepted_compression))
+    default = accepted.get("*", 0.0)
+    qualities = [accepted.get(codec, default) for codec in codecs]
+
+    best = max(qualities)
+    return codecs[qualities.index(best)] if best > 0 else ""
+
+
+def _as_buffer(body: Union[bytes, bytearray, memoryview]) -> memoryview:
+    """Return a flat bytes memoryview of a binary body (without copy if contiguous)."""
+    view = memoryview(body)
+    if not view.c_contiguous:
+        return memoryview(view.tobytes())
+
+    if view.format != "B" or view.ndim != 1:
+        return view.cast("B")
+
+    return view
+
+
+def _b64encode(body: Union[str, bytes, memoryview]) -> str:
+    """Encode a body to a base64 string."""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    return base64.b64encode(body).decode("ascii")
+
+
+# printable ASCII (but `"` and `\\`) and UTF-8 continuation bytes, not escaped
+_JSON_SAFE_BYTES = bytes(c for c in range(0x20, 0xC0) if c not in b'"\\\x7f')
+# characters escaped with 2 bytes (`\"`, `\\`, `\n`, ...)
+_NOT_SHORT_ESCAPE_BYTES = bytes(c for c in range(256) if c not in b'"\\\n\r\t\b\f')
+# UTF-8 lead bytes of characters outside the Basic Multilingual Plane
+_NOT_ASTRAL_BYTES = bytes(c for c in range(256) if not 0xF0 <= c <= 0xF7)
+
+
+def _get_serialized_size(value: Any) -> int:
+    """Return the size of a string serialized as JSON (without quotes)."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return memoryview(value).nbytes
+
+    value = str(value)
+    # keep the bytes of escaped characters (one byte per non ASCII character)
+    escaped = value.encode("utf-8", "surrogatepass").translate(None, _JSON_SAFE_BYTES)
+    if not escaped:
+        return len(value)
+
+    # `\"`, `\\`, `\n`, ... take 2 bytes, other control and non ASCII characters
+    # `\uXXXX` 6 bytes, and characters outside the BMP a surrogate pair (12 bytes)
+    short = len(escaped.translate(None, _NOT_SHORT_ESCAPE_BYTES))
+    astral = len(escaped.translate(None, _NOT_ASTRAL_BYTES))
+    return len(value) + short + 5 * (len(escaped) - short - astral) + 11 * astral
+
+
+def _get_response_size(message: Dict, threshold: int = 0) -> int:
+    """Return the approximate serialized size of a response message.
+
+    Text is measured once JSON encoded (non ASCII characters are escaped), as
+    the Lambda runtime serializes the response. Text bodies which can't be
+    larger than `threshold` once escaped (6 bytes per ASCII character, 12 per
+    non ASCII character at most) are measured by their length.
+
+    """
+    size = 64
+    for name, value in message["headers"].items():
+        size += _get_serialized_size(name) + _get_serialized_size(value) + 6
+
+    body = message.get("body") or ""
+    # base64 doesn't need escaping
+    if message.get("isBase64Encoded"):
+        return size + len(body)
+
+    if isinstance(body, str):
+        max_size = len(body) * (6 if body.isascii() else 12)
+        if size + max_size <= threshold:
+            return size + len(body)
+
+    return size + _get_serialized_size(body)
+
+
+def _get_etag(body: Union[str, bytes]) -> str:
+    """Return a strong ETag for a response body."""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return '"{}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest())
+
+
+def _etag_match(if_none_match: Optional[str], etag: str) -> bool:
+    """Check ETag against `If-None-Match` header (weak comparison)."""
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.replace("W/", "", 1) == etag.replace("W/", "", 1) for tag in tags)
+
+
+def _is_not_modified(request_headers: Dict, response_headers: Dict) -> bool:
+    """Check request validators against response `ETag` and `Last-Modified`."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match:
+        return _etag_match(if_none_match, response_headers.get("ETag", ""))
+
+    if_modified_since = request_headers.get("if-modified-since")
+    last_modified = response_headers.get("Last-Modified")
+    if not if_modified_since or not last_modified:
+        return False
+
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(
+            if_modified_since
+        )
+    except (TypeError, ValueError):
+        return False
+
+
+def _not_modified(message: Dict) -> Dict:
+    """Return a `304 Not Modified` message from a response message."""
+    headers = dict(message["headers"])
+    headers.pop("Content-Encoding", None)
+    return {"statusCode": 304, "headers": headers, "body": ""}
+
+
 def _get_apigw_stage(event: Dict) -> str:
     """Return API Gateway stage name."""
     header = event.get("headers", {})
@@ -142,6 +525,27 @@ def _get_request_path(event: Dict) -> Optional[str]:
     return event.get("path")
 
 
+def _from_payload_v2(event: Dict) -> Dict:
+    """Convert an HTTP API payload format 2.0 event to the 1.0 format."""
+    if event.get("version") != "2.0":
+        return event
+
+    http = event.get("requestContext", {}).get("http", {})
+    headers = dict(event.get("headers") or {})
+    if event.get("cookies"):
+        headers["cookie"] = "; ".join(event["cookies"])
+
+    query = parse_qs(event.get("rawQueryString", ""), keep_blank_values=True)
+    return dict(
+        event,
+        httpMethod=http.get("method", "GET"),
+        path=event.get("rawPath", http.get("path")),
+        headers=headers,
+        queryStringParameters=event.get("queryStringParameters") or {},
+        multiValueQueryStringParameters=query or None,
+    )
+
+
 class ApigwPath(object):
     """Parse path of API Call."""
 
@@ -169,10 +573,307 @@ class ApigwPath(object):
             return self.api_prefix
 
 
+class LinearRouter(object):
+    """Match routes by testing every route regex in registration order."""
+
+    def __init__(self) -> None:
+        """Initialize router."""
+        self.routes: List[RouteEntry] = []
+
+    def add(self, route: RouteEntry) -> None:
+        """Register a route."""
+        self.routes.append(route)
+
+    def match(self, url: str, method: str) -> Optional[RouteEntry]:
+        """Return the first registered route matching the url and method."""
+        for route in self.routes:
+            if method in route.methods and route.route_expr.match(url):
+                return route
+
+        return None
+
+
+class _TrieNode(object):
+    """Path segment node of a TrieRouter."""
+
+    __slots__ = ("literals", "typed", "patterns", "routes", "first")
+
+    def __init__(self) -> None:
+        """Initialize node."""
+        self.literals: Dict[str, _TrieNode] = {}
+        self.typed: Dict[str, Tuple[Any, _TrieNode]] = {}
+        self.patterns: Dict[str, Tuple[Any, _TrieNode]] = {}
+        self.routes: List[Tuple[int, RouteEntry]] = []
+        # Lowest registration index, per method, of the routes in this subtree.
+        self.first: Dict[str, int] = {}
+
+
+class TrieRouter(object):
+    """Match routes by walking a tree of path segments.
+
+    Segments are tried as literals first, then as typed parameters
+    (`<int:...>`, `<float:...>`, `<uuid:...>`, `<string:...>`) and finally as
+    `regex(...)` or mixed segments (e.g `<name>.<ext>`). Subtrees which cannot
+    hold a route registered before the current best candidate are skipped, so
+    the first registered route still wins.
+
+    Routes with a `regex()` parameter which might match a `/` (e.g `.+`) cannot
+    be split on segments and are tested with their full regex.
+
+    """
+
+    def __init__(self) -> None:
+        """Initialize router."""
+        self.root = _TrieNode()
+        self.fallback: List[Tuple[int, RouteEntry]] = []
+        self.count = 0
+
+    def add(self, route: RouteEntry) -> None:
+        """Register a route."""
+        index = self.count
+        self.count += 1
+
+        patterns = [arg["pattern"] or "" for arg in route._get_path_args()]
+        if any(slash_pattern.search(pattern) for pattern in patterns):
+            self.fallback.append((index, route))
+            return
+
+        node = self.root
+        for method in route.methods:
+            node.first.setdefault(method, index)
+
+        for segment in route.path.split("/"):
+            if "<" not in segment:
+                node = node.literals.setdefault(segment, _TrieNode())
+            else:
+                expr = _path_to_regex(segment)
+                match = param_pattern.match(segment)
+                if match and match.groupdict()["type"] != "regex":
+                    children = node.typed
+                else:
+                    children = node.patterns
+                if expr not in children:
+                    children[expr] = (re.compile(expr), _TrieNode())
+                node = children[expr][1]
+
+            for method in route.methods:
+                node.first.setdefault(method, index)
+
+        node.routes.append((index, route))
+
+    def _get_route(
+        self, node: _TrieNode, method: str, best: int
+    ) -> Optional[Tuple[int, RouteEntry]]:
+        for index, route in node.routes:
+            if index >= best:
+                break
+            if method in route.methods:
+                return index, route
+        return None
+
+    def _search(
+        self, node: _TrieNode, segments: List[str], depth: int, method: str, best: int
+    ) -> Optional[Tuple[int, RouteEntry]]:
+        if node.first.get(method, best) >= best:
+            return None
+
+        if depth == len(segments):
+            return self._get_route(node, method, best)
+
+        found = None
+        segment = segments[depth]
+        child = node.literals.get(segment)
+        if child is not None:
+            found = self._search(child, segments, depth + 1, method, best)
+            if found:
+                best = found[0]
+
+        for children in (node.typed, node.patterns):
+            for expr, child in children.values():
+                if child.first.get(method, best) >= best or not expr.match(segment):
+                    continue
+                candidate = self._search(child, segments, depth + 1, method, best)
+                if candidate:
+                    found = candidate
+                    best = found[0]
+
+        return found
+
+    def match(self, url: str, method: str) -> Optional[RouteEntry]:
+        """Return the first registered route matching the url and method."""
+        best = sys.maxsize
+        route = None
+
+        found = self._search(self.root, url.split("/"), 0, method, best)
+        if found:
+            best, route = found
+
+        for index, entry in self.fallback:
+            if index >= best:
+                break
+            if method in entry.methods and entry.route_expr.match(url):
+                return entry
+
+        return route
+
+
+class AlternationRouter(object):
+    """Match routes with one combined regex per HTTP method.
+
+    Route regexes are joined, in registration order, as named alternatives of a
+    single pattern so the `re` engine returns the first registered match.
+
+    """
+
+    def __init__(self) -> None:
+        """Initialize router."""
+        self.routes: List[RouteEntry] = []
+        self.expressions: Dict[str, Tuple[Any, Dict[str, RouteEntry]]] = {}
+
+    def add(self, route: RouteEntry) -> None:
+        """Register a route."""
+        self.routes.append(route)
+        self.expressions.clear()
+
+    def _compile(self, method: str) -> Tuple[Any, Dict[str, RouteEntry]]:
+        alternatives = []
+        names: Dict[str, RouteEntry] = {}
+        for index, route in enumerate(self.routes):
+            if method not in route.methods:
+                continue
+            name = f"route{index}"
+            names[name] = route
+            # strip `^` and `$` from the route regex
+            alternatives.append(f"(?P<{name}>{route.route_regex[1:-1]})")
+
+        expr = re.compile("^(?:" + "|".join(alternatives) + ")$")
+        return expr, names
+
+    def match(self, url: str, method: str) -> Optional[RouteEntry]:
+        """Return the first registered route matching the url and method."""
+        if method not in self.expressions:
+            self.expressions[method] = self._compile(method)
+
+        expr, names = self.expressions[method]
+        if not names:
+            return None
+
+        match = expr.match(url)
+        if not match:
+            return None
+
+        # The route group encloses the parameter groups, so it is closed last.
+        return names[match.lastgroup]
+
+
+routers: Dict[str, Callable] = {
+    "linear": LinearRouter,
+    "trie": TrieRouter,
+    "alternation": AlternationRouter,
+}
+
+# Request state, isolated between threads and asyncio tasks
+_request_event: contextvars.ContextVar = contextvars.ContextVar("event")
+_request_context: contextvars.ContextVar = contextvars.ContextVar("context")
+_request_path: contextvars.ContextVar = contextvars.ContextVar("request_path")
+
+
+# API and context of the batch handled by a worker process (set by its
+# initializer, in the worker)
+_batch_state: Tuple[Any, Any] = (None, None)
+
+
+def _get_sub_request_error(request: Any, batch_path: str) -> Optional[str]:
+    """Return the validation error of a batch sub-request, if any."""
+    if not isinstance(request, dict) or not isinstance(request.get("path"), str):
+        return "Sub-request must be an object with a `path`"
+
+    if request["path"] == batch_path:
+        return "Nested batch requests are not supported"
+
+    if not isinstance(request.get("method", "GET"), str):
+        return "Sub-request `method` must be a string"
+
+    query = request.get("query") or {}
+    if not isinstance(query, dict) or not all(
+        isinstance(value, (str, int, float)) for value in query.values()
+    ):
+        return "Sub-request `query` must be an object of string values"
+
+    return None
+
+
+def _reset_cache_locks(cache: Any) -> None:
+    """Replace the locks of a cache (and of its storage backends)."""
+    if cache is None:
+        return
+
+    if hasattr(cache, "_lock"):
+        cache._lock = threading.Lock()
+
+    for backend in ["backend", "memory", "disk"]:
+        _reset_cache_locks(getattr(cache, backend, None))
+
+
+def _init_batch_worker(app: Any, context: Any) -> None:
+    """Set the batch state and reset threads and locks of a forked worker.
+
+    Locks held by another thread when forking are copied in the held state and
+    would never be released in the worker.
+
+    """
+    global _batch_state
+
+    _batch_state = (app, context)
+    app._event_loop = None
+    app._event_loop_lock = threading.Lock()
+    app._compression_executor = None
+    app._executor_lock = threading.Lock()
+    _reset_cache_locks(app.route_cache)
+    _reset_cache_locks(app.compression_cache)
+    for route in app.routes:
+        _reset_cache_locks(route.cache)
+
+
+def _handle_batch_event(event: Dict) -> Dict:
+    """Handle a batch event in a worker process."""
+    app, context = _batch_state
+    return app(event, context)
+
+
+async def _run_in_context(context: contextvars.Context, coroutine: Any) -> Any:
+    """Await a coroutine with the variables of a context."""
+    for var, value in context.items():
+        var.set(value)
+
+    return await coroutine
+
+
 class API(object):
     """API."""
 
     FORMAT_STRING = "[%(name)s] - [%(levelname)s] - %(message)s"
+    DOCS_CACHE_CONTROL = "public, max-age=86400"
+    # AWS Lambda synchronous invocation response payload limit
+    MAX_RESPONSE_SIZE = 6 * 1024 * 1024
+    RESPONSE_SIZE_WARNING_RATIO = 0.8
+    INCOMPRESSIBLE_TYPES = (
+        "application/gzip",
+        "application/x-gzip",
+        "application/x-bzip2",
+        "application/x-xz",
+        "application/x-7z-compressed",
+        "application/zip",
+        "application/zstd",
+        "image/gif",
+        "image/jpeg",
+        "image/jpg",
+        "image/jp2",
+        "image/png",
+        "image/webp",
+        "audio/*",
+        "video/*",
+    )
 
     def __init__(
         self,
@@ -183,15 +884,56 @@ class API(object):
         configure_logs: bool = True,
         debug: bool = False,
         https: bool = True,
+        router: str = "trie",
+        route_cache_size: int = 0,
+        incompressible_types: Sequence[str] = None,
+        compression_min_size: int = 0,
+        compression_cache_size: int = 0,
+        parallel_compression_min_size: int = 0,
+        compression_workers: int = None,
+        trace_allocations: bool = False,
+        max_response_size: int = MAX_RESPONSE_SIZE,
+        compress_docs: bool = False,
     ) -> None:
         """Initialize API object."""
+        if router not in routers:
+            raise ValueError(f"'{router}' is not a supported router")
+
         self.name: str = name
         self.description: Optional[str] = description
         self.version: str = version
         self.routes: List[RouteEntry] = []
-        self.context: Dict = {}
-        self.event: Dict = {}
-        self.request_path: ApigwPath
+        self._router = routers[router]()
+        self._registry: Dict[str, Dict[str, RouteEntry]] = {}
+        self._static_routes: Dict[Tuple[str, str], RouteEntry] = {}
+        self._openapi_cache: Dict[str, Tuple[str, str]] = {}
+        self._docs_cache: Dict[Tuple[str, str], Tuple[str, bytes, str]] = {}
+        self.route_cache: Optional[LRUCache] = (
+            LRUCache(route_cache_size) if route_cache_size else None
+        )
+        self.incompressible_types: Set[str] = set(
+            self.INCOMPRESSIBLE_TYPES
+            if incompressible_types is None
+            else incompressible_types
+        )
+        self.compression_min_size: int = compression_min_size
+        self.codecs: Dict[str, Codec] = dict(default_codecs)
+        self.compression_cache: Optional[MemoryCache] = (
+            MemoryCache(max_entries=1024, max_bytes=compression_cache_size)
+            if compression_cache_size
+            else None
+        )
+        self.parallel_compression_min_size: int = parallel_compression_min_size
+        self.compression_workers: Optional[int] = compression_workers
+        self._compression_executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self.trace_allocations: bool = trace_allocations
+        self.max_response_size: int = max_response_size
+        self.compress_docs: bool = compress_docs
+        self._event_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event_loop_lock = threading.Lock()
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
         self.debug: bool = debug
         self.https: bool = https
         self.log = logging.getLogger(self.name)
@@ -200,6 +942,33 @@ class API(object):
         if add_docs:
             self.setup_docs()
 
+    @property
+    def event(self) -> Dict:
+        """API Gateway event of the current request."""
+        return _request_event.get({})
+
+    @event.setter
+    def event(self, event: Dict) -> None:
+        _request_event.set(event)
+
+    @property
+    def context(self) -> Any:
+        """Lambda context of the current request."""
+        return _request_context.get({})
+
+    @context.setter
+    def context(self, context: Any) -> None:
+        _request_context.set(context)
+
+    @property
+    def request_path(self) -> ApigwPath:
+        """Path of the current request."""
+        return _request_path.get()
+
+    @request_path.setter
+    def request_path(self, request_path: ApigwPath) -> None:
+        _request_path.set(request_path)
+
     @property
     def host(self) -> str:
         """Construct api gateway endpoint url."""
@@ -369,6 +1138,9 @@ class API(object):
         cache_control = kwargs.pop("cache_control", None)
         description = kwargs.pop("description", None)
         tag = kwargs.pop("tag", None)
+        cache = kwargs.pop("cache", None)
+        etag = kwargs.pop("etag", False)
+        compression_level = kwargs.pop("compression_level", 9)
 
         if ttl:
             warnings.warn(
@@ -402,37 +1174,98 @@ class API(object):
             cache_control,
             description,
             tag,
+            cache,
+            etag,
+            compression_level,
+            self.codecs,
         )
         self.routes.append(route)
+        for method in methods:
+            self._registry.setdefault(method, {})[path] = route
+
+        if "<" in path:
+            self._router.add(route)
+        else:
+            self._index_static_route(route)
+
+        if self.route_cache is not None:
+            self.route_cache.clear()
+
+        self._openapi_cache.clear()
+
+    def _index_static_route(self, route: RouteEntry) -> None:
+        """Index a static route by method and path.
+
+        A previously registered route matching the static path has precedence,
+        so we index it instead. Route regexes are matched directly, the router
+        might rebuild its structures on each match.
+
+        """
+        for method in route.methods:
+            self._static_routes[(method, route.path)] = route
+
+        for entry in reversed(self.routes):
+            if "<" in entry.path and entry.route_expr.match(route.path):
+                for method in set(entry.methods).intersection(route.methods):
+                    self._static_routes[(method, route.path)] = entry
 
     def _checkroute(self, path: str, method: str) -> bool:
-        for route in self.routes:
-            if method in route.methods and path == route.path:
-                return True
-        return False
+        return path in self._registry.get(method, {})
+
+    def _allowed_methods(self, url: str) -> List[str]:
+        """Return the HTTP methods with a route matching the url."""
+        return [method for method in self._registry if self._url_matching(url, method)]
 
     def _url_matching(self, url: str, method: str) -> Optional[RouteEntry]:
-        for route in self.routes:
-            expr = re.compile(route.route_regex)
-            if method in route.methods and expr.match(url):
-                return route
+        route = self._static_routes.get((method, url))
+        if route:
+            return route
 
-        return None
+        return self._router.match(url, method)
 
     def _get_matching_args(self, route: RouteEntry, url: str) -> Dict:
-        route_expr = re.compile(route.route_regex)
-        route_args = [i.group() for i in params_expr.finditer(route.path)]
-        url_args = route_expr.match(url).groups()
-
-        names = [param_pattern.match(arg).groupdict()["name"] for arg in route_args]
-
-        args = [
-            _converters(u, route_args[id])
-            for id, u in enumerate(url_args)
-            if u != route_args[id]
-        ]
+        url_args = route.route_expr.match(url).groups()
+        converters = route.arg_converters
+        args = [converters[id](u) for id, u in enumerate(url_args)]
+        return dict(zip(route.arg_names, args))
+
+    def _resolve(self, url: str, method: str) -> Optional[Tuple[RouteEntry, Dict]]:
+        """Return matching route and path arguments, using the route cache."""
+        if self.route_cache is None:
+            route = self._url_matching(url, method)
+            if not route:
+                return None
+            return route, self._get_matching_args(route, url)
+
+        resolved = self.route_cache.get((method, url))
+        if not resolved:
+            route = self._url_matching(url, method)
+            if not route:
+                return None
+            resolved = (route, self._get_matching_args(route, url))
+            self.route_cache.set((method, url), resolved)
+
+        return resolved[0], dict(resolved[1])
+
+    def _no_route_response(self, url: str, method: str) -> Dict:
+        """Return 405 if the url matches a route for other methods, or 400."""
+        allowed_methods = self._allowed_methods(url)
+        if allowed_methods:
+            message = self.response(
+                405,
+                "application/json",
+                json.dumps(
+                    {"errorMessage": f"Method not allowed for: {method} - {url}"}
+                ),
+            )
+            message["headers"]["Allow"] = ",".join(allowed_methods)
+            return message
 
-        return dict(zip(names, args))
+        return self.response(
+            "NOK",
+            "application/json",
+            json.dumps({"errorMessage": f"No view function for: {method} - {url}"}),
+        )
 
     def _validate_token(self, token: str = None) -> bool:
         env_token = os.environ.get("TOKEN")
@@ -476,6 +1309,13 @@ class API(object):
 
     def pass_context(self, f: Callable) -> Callable:
         """Decorator: pass the API Gateway context to the function."""
+        if inspect.iscoroutinefunction(f):
+
+            @wraps(f)
+            async def async_func(*args, **kwargs) -> Any:
+                return await f(self.context, *args, **kwargs)
+
+            return async_func
 
         @wraps(f)
         def new_func(*args, **kwargs) -> Callable:
@@ -485,6 +1325,13 @@ class API(object):
 
     def pass_event(self, f: Callable) -> Callable:
         """Decorator: pass the API Gateway event to the function."""
+        if inspect.iscoroutinefunction(f):
+
+            @wraps(f)
+            async def async_func(*args, **kwargs) -> Any:
+                return await f(self.event, *args, **kwargs)
+
+            return async_func
 
         @wraps(f)
         def new_func(*args, **kwargs) -> Callable:
@@ -492,47 +1339,281 @@ class API(object):
 
         return new_func
 
+    def _render_docs_page(
+        self, page: str, render: Callable, openapi_url: str
+    ) -> Tuple[str, bytes, str]:
+        """Return rendered page, gzip compressed page and ETag (cached per prefix)."""
+        openapi_prefix = self.request_path.prefix
+        key = (page, openapi_prefix)
+        if key not in self._docs_cache:
+            html = render(
+                openapi_url=f"{openapi_prefix}{openapi_url}",
+                title=f"{self.name} - {page}",
+            )
+            gzip_html = (
+                self.codecs["gzip"].compress(html.encode(), 9)
+                if self.compress_docs
+                else b""
+            )
+            self._docs_cache[key] = (html, gzip_html, _get_etag(html))
+
+        return self._docs_cache[key]
+
     def setup_docs(self) -> None:
         """Add default documentation routes."""
         openapi_url = f"/openapi.json"
 
-        def _openapi() -> Tuple[str, str, str]:
+        def _openapi() -> Tuple[str, str, str, Dict]:
             """Return OpenAPI json."""
-            return (
-                "OK",
-                "application/json",
-                json.dumps(self._get_openapi(openapi_prefix=self.request_path.prefix)),
-            )
+            openapi_prefix = self.request_path.prefix
+            if openapi_prefix not in self._openapi_cache:
+                body = json.dumps(self._get_openapi(openapi_prefix=openapi_prefix))
+                self._openapi_cache[openapi_prefix] = (body, _get_etag(body))
+
+            body, etag = self._openapi_cache[openapi_prefix]
+            if _etag_match(self.event["headers"].get("if-none-match"), etag):
+                return ("NOT_MODIFIED", "application/json", "", {"ETag": etag})
+
+            return ("OK", "application/json", body, {"ETag": etag})
 
         self._add_route(openapi_url, _openapi, cors=True, tag=["documentation"])
 
-        def _swagger_ui_html() -> Tuple[str, str, str]:
-            """Display Swagger HTML UI."""
-            openapi_prefix = self.request_path.prefix
-            return (
-                "OK",
-                "text/html",
-                templates.swagger(
-                    openapi_url=f"{openapi_prefix}{openapi_url}",
-                    title=self.name + " - Swagger UI",
-                ),
-            )
+        def _html_page(page: str, render: Callable) -> Tuple[str, str, Any, Dict]:
+            """Return a pre-rendered documentation page."""
+            html, gzip_html, etag = self._render_docs_page(page, render, openapi_url)
+
+            body: Union[str, bytes] = html
+            headers = {"Cache-Control": self.DOCS_CACHE_CONTROL}
+            if self.compress_docs:
+                headers["Vary"] = "Accept-Encoding"
+                accepted = self.event["headers"].get("accept-encoding", "")
+                if _select_compression(("gzip",), accepted):
+                    body = gzip_html
+                    etag = etag[:-1] + '-gzip"'
+                    headers["Content-Encoding"] = "gzip"
 
-        self._add_route("/docs", _swagger_ui_html, cors=True, tag=["documentation"])
+            headers["ETag"] = etag
+            if _etag_match(self.event["headers"].get("if-none-match"), etag):
+                headers.pop("Content-Encoding", None)
+                return ("NOT_MODIFIED", "text/html", "", headers)
 
-        def _redoc_ui_html() -> Tuple[str, str, str]:
+            return ("OK", "text/html", body, headers)
+
+        def _swagger_ui_html() -> Tuple[str, str, Any, Dict]:
+            """Display Swagger HTML UI."""
+            return _html_page("Swagger UI", templates.swagger)
+
+        self._add_route(
+            "/docs",
+            _swagger_ui_html,
+            cors=True,
+            binary_b64encode=self.compress_docs,
+            tag=["documentation"],
+        )
+
+        def _redoc_ui_html() -> Tuple[str, str, Any, Dict]:
             """Display Redoc HTML UI."""
-            openapi_prefix = self.request_path.prefix
-            return (
-                "OK",
-                "text/html",
-                templates.redoc(
-                    openapi_url=f"{openapi_prefix}{openapi_url}",
-                    title=self.name + " - ReDoc",
-                ),
+            return _html_page("ReDoc", templates.redoc)
+
+        self._add_route(
+            "/redoc",
+            _redoc_ui_html,
+            cors=True,
+            binary_b64encode=self.compress_docs,
+            tag=["documentation"],
+        )
+
+    def setup_batch(
+        self, path: str = "/batch", workers: int = 0, max_requests: int = 50, **kwargs
+    ) -> None:
+        """Add a route handling many sub-requests in one invocation.
+
+        The route takes a JSON array of `{method, path, query, body}` objects
+        and returns the array of responses.
+
+        path: route path.
+        workers: number of threads handling the sub-requests (sequential if 0).
+        max_requests: maximum number of sub-requests.
+        kwargs: route options (e.g. `cors`, `payload_compression_method`).
+
+        """
+
+        def _batch(body: str = None) -> Tuple[str, str, str]:
+            """Handle a batch of requests."""
+            try:
+                requests = json.loads(body or "")
+            except ValueError:
+                requests = None
+
+            if not isinstance(requests, list):
+                error = "Request body must be a JSON array of requests"
+                return ("NOK", "application/json", json.dumps({"errorMessage": error}))
+
+            if len(requests) > max_requests:
+                error = f"Too many requests, maximum is {max_requests}"
+                return ("NOK", "application/json", json.dumps({"errorMessage": error}))
+
+            event, context = self.event, self.context
+
+            def handle(request: Any) -> Dict:
+                # isolate sub-request state from the batch request
+                request_context = contextvars.copy_context()
+                return request_context.run(
+                    self._handle_sub_request, request, path, event, context
+                )
+
+            if workers:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    responses = list(pool.map(handle, requests))
+            else:
+                responses = [handle(request) for request in requests]
+
+            return ("OK", "application/json", json.dumps(responses))
+
+        kwargs.setdefault("tag", ["batch"])
+        self._add_route(path, _batch, methods=["POST"], **kwargs)
+
+    def _handle_sub_request(
+        self, request: Any, batch_path: str, event: Dict, context: Any
+    ) -> Dict:
+        """Handle a batch sub-request, with the batch request headers."""
+        error = _get_sub_request_error(request, batch_path)
+        if error:
+            message = self.response(
+                "NOK", "application/json", json.dumps({"errorMessage": error})
+            )
+        else:
+            body = request.get("body")
+            if body is not None and not isinstance(body, str):
+                body = json.dumps(body)
+
+            # Sub-responses are returned in a JSON array (the batch response
+            # can be compressed), and the batch conditional headers are not
+            # about the sub-requests resources
+            headers = {
+                name: value
+                for name, value in event["headers"].items()
+                if name != "accept-encoding" and not name.startswith("if-")
+            }
+            message = self(
+                {
+                    "path": request["path"],
+                    "httpMethod": request.get("method", "GET").upper(),
+                    "headers": headers,
+                    "queryStringParameters": {
+                        name: str(value)
+                        for name, value in (request.get("query") or {}).items()
+                    },
+                    "body": body,
+                    "requestContext": event.get("requestContext", {}),
+                },
+                context,
             )
 
-        self._add_route("/redoc", _redoc_ui_html, cors=True, tag=["documentation"])
+        if not isinstance(message["body"], str):
+            message["body"] = _b64encode(message["body"])
+            message["isBase64Encoded"] = True
+
+        return message
+
+    def register_codec(
+        self,
+        name: str,
+        compress: Callable[[bytes, int], bytes],
+        compressobj: Callable[[int], Any] = None,
+    ) -> None:
+        """Register a compression codec.
+
+        name: `Content-Encoding` name of the codec.
+        compress: function compressing a body, called with `(body, level)`.
+        compressobj: optional function returning a streaming compressor.
+
+        """
+        self.codecs[name] = Codec(name, compress, compressobj)
+        if self.compression_cache is not None:
+            self.compression_cache.clear()
+
+    def _get_remaining_time(self) -> Optional[int]:
+        """Return the Lambda remaining execution time (in ms)."""
+        get_remaining_time = getattr(self.context, "get_remaining_time_in_millis", None)
+        return get_remaining_time() if get_remaining_time else None
+
+    def _compression_level(self, compression_level: Union[int, str], size: int) -> int:
+        """Return the compression level, selected from the context if `auto`."""
+        if compression_level == "auto":
+            return _get_compression_level(size, self._get_remaining_time())
+
+        return int(compression_level)
+
+    def _is_compressible(self, content_type: str, body: Union[str, bytes]) -> bool:
+        """Check if a response body is worth compressing."""
+        if len(body) < self.compression_min_size:
+            return False
+
+        mime_type = content_type.split(";")[0].strip().lower()
+        if mime_type in self.incompressible_types:
+            return False
+
+        return mime_type.split("/")[0] + "/*" not in self.incompressible_types
+
+    def _compress_body(
+        self,
+        headers: Dict,
+        content_type: str,
+        body: Any,
+        compression: Tuple[str, ...],
+        accepted_compression: str,
+        compression_level: Union[int, str],
+    ) -> Any:
+        """Compress the response body with the negotiated codec."""
+        if not compression or not self._is_compressible(content_type, body):
+            return body
+
+        headers["Vary"] = "Accept-Encoding"
+        codec = _select_compression(compression, accepted_compression)
+        if not codec:
+            return body
+
+        headers["Content-Encoding"] = codec
+        if isinstance(body, str):
+            body = bytes(body, "utf-8")
+
+        return self._compress(
+            body, codec, self._compression_level(compression_level, len(body))
+        )
+
+    def _compress(self, body: bytes, compression: str, level: int = 9) -> bytes:
+        """Compress response body with a registered codec."""
+        try:
+            codec = self.codecs[compression]
+        except KeyError:
+            raise ValueError(f"Unsupported compression mode: {compression}")
+
+        if self.compression_cache is None:
+            return self._codec_compress(codec, body, level)
+
+        key = (hashlib.blake2b(body, digest_size=16).digest(), compression, level)
+        compressed = self.compression_cache.get(key)
+        if compressed is None:
+            compressed = self._codec_compress(codec, body, level)
+            self.compression_cache.set(key, compressed, len(compressed))
+
+        return compressed
+
+    def _codec_compress(self, codec: Codec, body: bytes, level: int) -> bytes:
+        """Compress body, by blocks on a thread pool for large bodies."""
+        min_size = self.parallel_compression_min_size
+        if not min_size or not codec.parallel_compress or len(body) < min_size:
+            return codec.compress(body, level)
+
+        with self._executor_lock:
+            if self._compression_executor is None:
+                self._compression_executor = ThreadPoolExecutor(
+                    max_workers=self.compression_workers,
+                    thread_name_prefix="lambda-proxy-compression",
+                )
+
+        return codec.parallel_compress(body, level, self._compression_executor)
 
     def response(
         self,
@@ -542,10 +1623,12 @@ class API(object):
         cors: bool = False,
         accepted_methods: Sequence = [],
         accepted_compression: str = "",
-        compression: str = "",
+        compression: Union[str, Sequence[str]] = "",
         b64encode: bool = False,
         ttl: int = None,
         cache_control: str = None,
+        headers: Dict = None,
+        compression_level: Union[int, str] = 9,
     ):
         """Return HTTP response.
 
@@ -557,6 +1640,7 @@ class API(object):
             "EMPTY": 204,
             "NOK": 400,
             "FOUND": 302,
+            "NOT_MODIFIED": 304,
             "NOT_FOUND": 404,
             "CONFLICT": 409,
             "ERROR": 500,
@@ -576,6 +1660,8 @@ class API(object):
         ]
 
         status = statusCode[status] if isinstance(status, str) else status
+        if isinstance(response_body, (bytearray, memoryview)):
+            response_body = _as_buffer(response_body)
 
         messageData: Dict[str, Any] = {
             "statusCode": status,
@@ -589,67 +1675,379 @@ class API(object):
             )
             messageData["headers"]["Access-Control-Allow-Credentials"] = "true"
 
-        if compression and compression in accepted_compression:
-            messageData["headers"]["Content-Encoding"] = compression
-            if isinstance(response_body, str):
-                response_body = bytes(response_body, "utf-8")
-
-            if compression == "gzip":
-                gzip_compress = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
-                response_body = (
-                    gzip_compress.compress(response_body) + gzip_compress.flush()
-                )
-            elif compression == "zlib":
-                zlib_compress = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS)
-                response_body = (
-                    zlib_compress.compress(response_body) + zlib_compress.flush()
-                )
-            elif compression == "deflate":
-                deflate_compress = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
-                response_body = (
-                    deflate_compress.compress(response_body) + deflate_compress.flush()
-                )
-            else:
-                return self.response(
-                    "ERROR",
-                    "application/json",
-                    json.dumps(
-                        {"errorMessage": f"Unsupported compression mode: {compression}"}
-                    ),
-                )
+        try:
+            response_body = self._compress_body(
+                messageData["headers"],
+                content_type,
+                response_body,
+                _get_codecs(compression),
+                accepted_compression,
+                compression_level,
+            )
+        except ValueError as err:
+            return self.response(
+                "ERROR", "application/json", json.dumps({"errorMessage": str(err)})
+            )
 
         if ttl:
             messageData["headers"]["Cache-Control"] = (
-                f"max-age={ttl}" if status == 200 else "no-cache"
+                f"max-age={ttl}" if status in [200, 304] else "no-cache"
             )
         elif cache_control:
             messageData["headers"]["Cache-Control"] = (
-                cache_control if status == 200 else "no-cache"
+                cache_control if status in [200, 304] else "no-cache"
             )
 
+        if headers:
+            messageData["headers"].update(headers)
+
         if (
             content_type in binary_types or not isinstance(response_body, str)
         ) and b64encode:
             messageData["isBase64Encoded"] = True
-            messageData["body"] = base64.b64encode(response_body).decode()
+            messageData["body"] = _b64encode(response_body)
+        elif isinstance(response_body, memoryview):
+            messageData["body"] = response_body.tobytes()
         else:
             messageData["body"] = response_body
 
         return messageData
 
+    @property
+    def event_loop(self) -> asyncio.AbstractEventLoop:
+        """Event loop running async endpoints.
+
+        The loop is created on first use and runs in a background thread for
+        the lifetime of the container (it is reused across invocations).
+
+        """
+        with self._event_loop_lock:
+            if self._event_loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever,
+                    name="lambda-proxy-event-loop",
+                    daemon=True,
+                )
+                thread.start()
+                self._event_loop = loop
+
+        return self._event_loop
+
+    def _run_async(self, coroutine: Any) -> Any:
+        """Run a coroutine on the API event loop and wait for its result."""
+        coroutine = _run_in_context(contextvars.copy_context(), coroutine)
+        return asyncio.run_coroutine_threadsafe(coroutine, self.event_loop).result()
+
+    def _call_endpoint(self, route: RouteEntry, function_kwargs: Dict) -> Tuple:
+        """Call route endpoint, returning an error response on exception."""
+        try:
+            response = route.endpoint(**function_kwargs)
+            # also await the coroutines of sync callables (e.g. partial or
+            # decorated async functions)
+            if route.is_async or inspect.isawaitable(response):
+                return self._run_async(response)
+
+            return response
+        except Exception as err:
+            self.log.error(str(err))
+            return (
+                "ERROR",
+                "application/json",
+                json.dumps({"errorMessage": str(err)}),
+            )
+
+    def _get_response(
+        self, route: RouteEntry, function_kwargs: Dict, etag: str = None
+    ) -> Dict:
+        """Call route endpoint and return the response message."""
+        response = self._call_endpoint(route, function_kwargs)
+
+        message = self._get_response_message(route, response)
+        if self.max_response_size:
+            message = self._check_response_size(route, response, message)
+
+        if route.etag and message["statusCode"] == 200:
+            message["headers"]["ETag"] = etag or _get_etag(message["body"])
+
+        return message
+
+    def _get_response_message(
+        self, route: RouteEntry, response: Tuple, compression_level: Any = None
+    ) -> Dict:
+        """Create the response message from the route endpoint output."""
+        return self.response(
+            response[0],
+            response[1],
+            response[2],
+            cors=route.cors,
+            accepted_methods=route.methods,
+            accepted_compression=self.event["headers"].get("accept-encoding", ""),
+            compression=route.compressions,
+            b64encode=route.b64encode,
+            ttl=route.ttl,
+            cache_control=route.cache_control,
+            headers=response[3] if len(response) > 3 else None,
+            compression_level=compression_level or route.compression_level,
+        )
+
+    def _check_response_size(
+        self, route: RouteEntry, response: Tuple, message: Dict
+    ) -> Dict:
+        """Keep response message under the maximum response size.
+
+        Oversized compressed responses are compressed again with the highest
+        compression level, else an error is returned.
+
+        """
+        # smaller responses don't need to be measured precisely
+        threshold = int(self.max_response_size * self.RESPONSE_SIZE_WARNING_RATIO)
+        size = _get_response_size(message, threshold)
+        compressed = message["headers"].get("Content-Encoding")
+        oversized = size > self.max_response_size
+        if oversized and compressed and route.compression_level != 9:
+            self.log.warning(
+                f"{route.path} response size ({size} bytes) exceeds the limit, "
+                "using highest compression level"
+            )
+            message = self._get_response_message(route, response, 9)
+            size = _get_response_size(message, threshold)
+
+        route.peak_response_size = max(route.peak_response_size, size)
+        if size <= self.max_response_size:
+            if size > self.max_response_size * self.RESPONSE_SIZE_WARNING_RATIO:
+                self.log.warning(
+                    f"{route.path} response size ({size} bytes) is close to the limit"
+                )
+            return message
+
+        route.oversized_responses += 1
+        self.log.error(
+            f"{route.path} response size ({size} bytes) exceeds the limit "
+            f"({self.max_response_size} bytes)"
+        )
+        return self.response(
+            502,
+            "application/json",
+            json.dumps(
+                {
+                    "errorMessage": "Response payload size exceeds the limit",
+                    "size": size,
+                    "limit": self.max_response_size,
+                }
+            ),
+        )
+
+    def _get_cached_response(
+        self,
+        route: RouteEntry,
+        function_kwargs: Dict,
+        path_args: Dict,
+        request_params: Dict,
+        etag: str = None,
+    ) -> Dict:
+        """Return response message from the route cache or call the endpoint."""
+        encoding = _select_compression(
+            route.compressions, self.event["headers"].get("accept-encoding", "")
+        )
+        key = route.cache.get_key(route.path, path_args, request_params, encoding)
+        message = route.cache.get(key)
+        if message is not None:
+            return message
+
+        message = self._get_response(route, function_kwargs, etag)
+        if message["statusCode"] == 200:
+            route.cache.set(key, message, route.cache_ttl)
+            message = dict(message, headers=dict(message["headers"]))
+
+        return message
+
+    def _get_validator(
+        self, validator_function: Callable, function_kwargs: Dict
+    ) -> Optional[str]:
+        """Return the (weak) ETag computed by a route validator function."""
+        try:
+            validator = validator_function(**function_kwargs)
+            if inspect.isawaitable(validator):
+                validator = self._run_async(validator)
+        except Exception as err:
+            self.log.error(f"ETag validator error: {err}")
+            return None
+
+        if validator is None:
+            return None
+
+        validator = str(validator)
+        if validator.startswith("W/"):
+            return validator
+
+        return 'W/"{}"'.format(validator.strip('"'))
+
+    def _dispatch(
+        self,
+        route: RouteEntry,
+        function_kwargs: Dict,
+        path_args: Dict,
+        request_params: Dict,
+        http_method: str,
+    ) -> Dict:
+        """Return route response, tracing memory allocations if enabled."""
+        args = (route, function_kwargs, path_args, request_params, http_method)
+        if not self.trace_allocations:
+            return self._get_route_response(*args)
+
+        start, _ = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.clear_traces()
+            start = 0
+
+        message = self._get_route_response(*args)
+
+        _, peak = tracemalloc.get_traced_memory()
+        peak_allocation = max(peak - start, 0)
+        route.peak_allocation = max(route.peak_allocation, peak_allocation)
+        self.log.info(
+            f"{http_method} {route.path} peak allocation: {peak_allocation} bytes"
+        )
+        return message
+
+    def _get_route_response(
+        self,
+        route: RouteEntry,
+        function_kwargs: Dict,
+        path_args: Dict,
+        request_params: Dict,
+        http_method: str,
+    ) -> Dict:
+        """Return route response, honoring response cache and validators."""
+        # Conditional requests only apply to safe methods, the endpoint of other
+        # methods is always called (e.g. a POST with side effects)
+        if http_method not in ["GET", "HEAD"]:
+            return self._get_response(route, function_kwargs)
+
+        request_headers = self.event["headers"]
+
+        etag = None
+        if callable(route.etag):
+            etag = self._get_validator(route.etag, function_kwargs)
+            # Don't call the endpoint when the client already has the response
+            if etag and _etag_match(request_headers.get("if-none-match"), etag):
+                message = self.response(
+                    "NOT_MODIFIED",
+                    "text/plain",
+                    "",
+                    cors=route.cors,
+                    accepted_methods=route.methods,
+                    ttl=route.ttl,
+                    cache_control=route.cache_control,
+                    headers={"ETag": etag},
+                )
+                return _not_modified(message)
+
+        if route.cache and http_method == "GET":
+            message = self._get_cached_response(
+                route, function_kwargs, path_args, request_params, etag
+            )
+        else:
+            message = self._get_response(route, function_kwargs, etag)
+
+        if not route.etag or message["statusCode"] != 200:
+            return message
+
+        if _is_not_modified(request_headers, message["headers"]):
+            return _not_modified(message)
+
+        return message
+
+    def warmup(self, event_loop: bool = True) -> None:
+        """Prepare lazily built router structures for the registered methods.
+
+        event_loop: also start the event loop thread (if there are async routes).
+
+        """
+        for method in self._registry:
+            self._router.match("", method)
+
+        if event_loop and any(route.is_async for route in self.routes):
+            self.event_loop  # start the event loop thread
+
+    def handle_batch(
+        self,
+        events: Sequence[Dict],
+        context: Any = None,
+        workers: int = None,
+        executor: str = "thread",
+    ) -> Tuple[List[Dict], Dict]:
+        """Handle API Gateway events concurrently.
+
+        events: API Gateway events.
+        context: Lambda context passed to all the events.
+        workers: number of worker threads or processes.
+        executor: `thread` or `process` (forked processes) workers.
+
+        Returns the responses, in the events order, and the batch statistics.
+
+        """
+        if executor not in ["thread", "process"]:
+            raise ValueError(f"'{executor}' is not a supported executor")
+
+        # Don't start threads before forking: they would not run in the workers
+        self.warmup(event_loop=executor == "thread")
+        start = time.perf_counter()
+        if executor == "thread":
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                responses = list(pool.map(lambda event: self(event, context), events))
+        else:
+            responses = self._handle_batch_processes(events, context, workers)
+
+        duration = time.perf_counter() - start
+        stats = {
+            "count": len(responses),
+            "errors": sum(1 for res in responses if res["statusCode"] >= 500),
+            "duration": duration,
+            "throughput": len(responses) / duration if duration else 0.0,
+            "executor": executor,
+            "workers": workers,
+        }
+        self.log.info(
+            f"Batch of {stats['count']} events handled in {duration:.3f}s "
+            f"({stats['throughput']:.1f} events/s)"
+        )
+        return responses, stats
+
+    def _handle_batch_processes(
+        self, events: Sequence[Dict], context: Any, workers: Optional[int]
+    ) -> List[Dict]:
+        """Handle events on forked worker processes."""
+        workers = workers or os.cpu_count() or 1
+        # The API and context are inherited (not pickled) by the forked workers
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_batch_worker,
+            initargs=(self, context),
+        ) as pool:
+            chunksize = max(1, len(events) // (workers * 4))
+            return list(pool.map(_handle_batch_event, events, chunksize=chunksize))
+
     def __call__(self, event, context):
         """Initialize route and handlers."""
         self.log.debug(json.dumps(event, default=str))
 
-        self.event = event
-        self.context = context
+        event = _from_payload_v2(event)
 
         # HACK: For an unknown reason some keys can have lower or upper case.
         # To make sure the app works well we cast all the keys to lowercase.
-        headers = self.event.get("headers", {}) or {}
-        self.event["headers"] = dict(
-            (key.lower(), value) for key, value in headers.items()
+        # The event is copied so the caller's event (e.g. reused in a batch)
+        # is not modified.
+        headers = event.get("headers", {}) or {}
+        event = dict(
+            event, headers=dict((key.lower(), value) for key, value in headers.items())
         )
+        self.event = event
+        self.context = context
 
         self.request_path = ApigwPath(self.event)
         if self.request_path.path is None:
@@ -660,21 +2058,13 @@ class API(object):
             )
 
         http_method = event["httpMethod"]
-        route_entry = self._url_matching(self.request_path.path, http_method)
-        if not route_entry:
-            return self.response(
-                "NOK",
-                "application/json",
-                json.dumps(
-                    {
-                        "errorMessage": "No view function for: {} - {}".format(
-                            http_method, self.request_path.path
-                        )
-                    }
-                ),
-            )
+        resolved = self._resolve(self.request_path.path, http_method)
+        if not resolved:
+            return self._no_route_response(self.request_path.path, http_method)
 
-        request_params = event.get("queryStringParameters", {}) or {}
+        route_entry, function_kwargs = resolved
+        path_args = dict(function_kwargs)
+        request_params = dict(event.get("queryStringParameters", {}) or {})
         if route_entry.token:
             if not self._validate_token(request_params.get("access_token")):
                 return self.response(
@@ -686,33 +2076,25 @@ class API(object):
         # remove access_token from kwargs
         request_params.pop("access_token", False)
 
-        function_kwargs = self._get_matching_args(route_entry, self.request_path.path)
-        function_kwargs.update(request_params.copy())
+        try:
+            function_kwargs = route_entry.binder.bind(
+                function_kwargs,
+                request_params,
+                event.get("multiValueQueryStringParameters"),
+            )
+        except ValueError as err:
+            return self.response(
+                "NOK",
+                "application/json",
+                json.dumps({"errorMessage": str(err)}),
+            )
+
         if http_method in ["POST", "PUT", "PATCH"] and event.get("body"):
             body = event["body"]
             if event.get("isBase64Encoded"):
                 body = base64.b64decode(body).decode()
             function_kwargs.update(dict(body=body))
 
-        try:
-            response = route_entry.endpoint(**function_kwargs)
-        except Exception as err:
-            self.log.error(str(err))
-            response = (
-                "ERROR",
-                "application/json",
-                json.dumps({"errorMessage": str(err)}),
-            )
-
-        return self.response(
-            response[0],
-            response[1],
-            response[2],
-            cors=route_entry.cors,
-            accepted_methods=route_entry.methods,
-            accepted_compression=self.event["headers"].get("accept-encoding", ""),
-            compression=route_entry.compression,
-            b64encode=route_entry.b64encode,
-            ttl=route_entry.ttl,
-            cache_control=route_entry.cache_control,
+        return self._dispatch(
+            route_entry, function_kwargs, path_args, request_params, http_method
         )
@@ -0,0 +1,442 @@
+"""lambda-proxy: local HTTP server.
+
+Serve an `API` locally, translating HTTP requests to API Gateway events.
+
+    $ python -m lambda_proxy.server handler:app --port 8000 --workers 8
+
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import sys
+import time
+import queue
+import base64
+import socket
+import argparse
+import importlib
+import selectors
+import threading
+from io import BufferedReader
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from lambda_proxy.proxy import API
+
+
+def _get_query_params(query: str) -> Tuple[Dict[str, str], Dict[str, List[str]]]:
+    """Return single (last value) and multi values query parameters."""
+    params = parse_qs(query, keep_blank_values=True)
+    return {k: v[-1] for k, v in params.items()}, params
+
+
+def get_event(
+    method: str,
+    url: str,
+    headers: List[Tuple[str, str]],
+    body: bytes = b"",
+    version: str = "1.0",
+    source_ip: str = "127.0.0.1",
+) -> Dict:
+    """Create an API Gateway event from an HTTP request.
+
+    version: `1.0` (REST API and HTTP API payload format 1.0) or `2.0` (HTTP
+    API payload format 2.0).
+
+    """
+    if version not in ["1.0", "2.0"]:
+        raise ValueError(f"'{version}' is not a supported event version")
+
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    request_id = f"{time.time_ns():x}"
+    encoded_body = base64.b64encode(body).decode() if body else None
+
+    single_headers: Dict[str, str] = {}
+    multi_headers: Dict[str, List[str]] = {}
+    for name, value in headers:
+        single_headers[name] = value
+        multi_headers.setdefault(name, []).append(value)
+
+    if version == "2.0":
+        params = parse_qs(parts.query, keep_blank_values=True)
+        query = {k: ",".join(v) for k, v in params.items()}
+        cookies = [
+            cookie
+            for name in list(multi_headers)
+            if name.lower() == "cookie"
+            for cookie in multi_headers.pop(name)
+        ]
+        event = {
+            "version": "2.0",
+            "routeKey": "$default",
+            "rawPath": path,
+            "rawQueryString": parts.query,
+            "headers": {
+                name.lower(): ",".join(values) for name, values in multi_headers.items()
+            },
+            "queryStringParameters": query or None,
+            "requestContext": {
+                "http": {"method": method, "path": path, "sourceIp": source_ip},
+                "requestId": request_id,
+                "routeKey": "$default",
+                "stage": "$default",
+            },
+            "body": encoded_body,
+            "isBase64Encoded": bool(body),
+        }
+        if cookies:
+            event["cookies"] = [c.strip() for v in cookies for c in v.split(";")]
+
+        return event
+
+    query, multi_query = _get_query_params(parts.query)
+    return {
+        "resource": "/{proxy+}",
+        "path": path,
+        "httpMethod": method,
+        "headers": single_headers,
+        "multiValueHeaders": multi_headers,
+        "queryStringParameters": query or None,
+        "multiValueQueryStringParameters": multi_query or None,
+        "pathParameters": {"proxy": path[1:]},
+        "requestContext": {
+            "httpMethod": method,
+            "path": path,
+            "requestId": request_id,
+            "resourcePath": "/{proxy+}",
+            "stage": "local",
+            "identity": {"sourceIp": source_ip},
+        },
+        "body": encoded_body,
+        "isBase64Encoded": bool(body),
+    }
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Translate HTTP requests to API Gateway events.
+
+    Keep-alive connections are handed back to the server between requests
+    (see `ThreadPoolHTTPServer`), so a handler handles the requests of a
+    connection in many `handle()` calls.
+
+    """
+
+    protocol_version = "HTTP/1.1"
+    # socket timeout while reading a request (in seconds)
+    timeout = 5
+    # headers and body are written separately, don't wait for the ACK of the
+    # headers segment (delayed ACK) before sending the body
+    disable_nagle_algorithm = True
+    rfile: BufferedReader
+    server: "ThreadPoolHTTPServer"
+
+    def handle(self) -> None:
+        """Handle the available requests of the connection."""
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self._is_buffered():
+            self.handle_one_request()
+
+    def _is_buffered(self) -> bool:
+        """Check for (pipelined) request data, without blocking."""
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def finish(self) -> None:
+        """Close the connection files, unless the connection is kept alive."""
+        if self.close_connection:
+            super().finish()
+
+    def resume(self) -> None:
+        """Handle the next requests of a kept alive connection."""
+        try:
+            self.handle()
+        finally:
+            self.finish()
+
+    def _read_body(self) -> bytes:
+        """Read request body (with Content-Length or chunked encoding)."""
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if not size:
+                    # skip trailers
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b"".join(chunks)
+
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def handle_request(self) -> None:
+        """Handle request with the API."""
+        event = get_event(
+            self.command,
+            self.path,
+            list(self.headers.items()),
+            self._read_body(),
+            version=self.server.event_version,
+            source_ip=self.client_address[0],
+        )
+        response = self.server.app(event, None)
+
+        body = response.get("body") or b""
+        if response.get("isBase64Encoded"):
+            body = base64.b64decode(body)
+        elif isinstance(body, str):
+            body = body.encode("utf-8")
+
+        status = int(response["statusCode"])
+        self.send_response(status)
+        for name, value in response.get("headers", {}).items():
+            if name.lower() not in ["content-length", "connection"]:
+                self.send_header(name, value)
+
+        no_body = self.command == "HEAD" or status in [204, 304] or status < 200
+        self.send_header("Content-Length", str(0 if no_body else len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+
+        if not no_body:
+            self.wfile.write(body)
+
+    do_GET = handle_request
+    do_HEAD = handle_request
+    do_POST = handle_request
+    do_PUT = handle_request
+    do_PATCH = handle_request
+    do_DELETE = handle_request
+    do_OPTIONS = handle_request
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Log requests with the API logger."""
+        self.server.app.log.info(f"{self.address_string()} - {format % args}")
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """HTTP server handling requests on a fixed pool of worker threads.
+
+    Accepted connections wait in a bounded queue, connections are rejected
+    with a `503` response when the queue is full.
+
+    Between requests, keep-alive connections don't hold a worker: they are
+    watched by a selector thread and queued again when the next request
+    arrives, or closed after `keep_alive_timeout` seconds.
+
+    """
+
+    def __init__(
+        self,
+        server_address: Tuple[str, int],
+        app: API,
+        workers: int = 8,
+        queue_size: int = 64,
+        event_version: str = "1.0",
+        handler: Any = RequestHandler,
+        keep_alive_timeout: float = 5,
+    ) -> None:
+        """Initialize server and start the worker threads."""
+        if event_version not in ["1.0", "2.0"]:
+            raise ValueError(f"'{event_version}' is not a supported event version")
+
+        super().__init__(server_address, handler)
+        self.app = app
+        self.handler = handler
+        self.event_version = event_version
+        self.keep_alive_timeout = keep_alive_timeout
+        self.requests: queue.Queue = queue.Queue(maxsize=queue_size)
+
+        self._idle: List[Tuple] = []
+        self._idle_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._waker, self._wakeup = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._idle_watcher = threading.Thread(
+            target=self._watch_idle, name="lambda-proxy-server-idle", daemon=True
+        )
+        self._idle_watcher.start()
+
+        self.workers = [
+            threading.Thread(
+                target=self._worker, name=f"lambda-proxy-server-{i}", daemon=True
+            )
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def _worker(self) -> None:
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+
+            request, client_address, handler = item
+            try:
+                if handler is None:
+                    handler = self.handler(request, client_address, self)
+                else:
+                    handler.resume()
+            except Exception:
+                self.handle_error(request, client_address)
+                handler = None
+
+            if handler is not None and not handler.close_connection:
+                self._keep_alive(request, client_address, handler)
+            else:
+                self.shutdown_request(request)
+
+    def _keep_alive(self, request: Any, client_address: Any, handler: Any) -> None:
+        """Hand an idle connection to the selector thread."""
+        with self._idle_lock:
+            self._idle.append((request, client_address, handler, time.monotonic()))
+        try:
+            self._wakeup.send(b"\0")
+        except OSError:
+            pass
+
+    def _watch_idle(self) -> None:
+        """Queue idle connections with a new request, close expired ones."""
+        selector = selectors.DefaultSelector()
+        selector.register(self._waker, selectors.EVENT_READ)
+        while not self._stopping.is_set():
+            for key, _ in selector.select(timeout=min(1, self.keep_alive_timeout)):
+                if key.fileobj is self._waker:
+                    self._waker.recv(4096)
+                    with self._idle_lock:
+                        idle, self._idle = self._idle, []
+                    for item in idle:
+                        selector.register(item[0], selectors.EVENT_READ, item)
+                    continue
+
+                selector.unregister(key.fileobj)
+                request, client_address, handler, _ = key.data
+                self.requests.put((request, client_address, handler))
+
+            expired = time.monotonic() - self.keep_alive_timeout
+            for key in list(selector.get_map().values()):
+                if key.data is not None and key.data[3] < expired:
+                    selector.unregister(key.fileobj)
+                    self.shutdown_request(key.data[0])
+
+        for key in list(selector.get_map().values()):
+            if key.data is not None:
+                self.shutdown_request(key.data[0])
+        selector.close()
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        """Queue the connection for the worker threads."""
+        try:
+            self.requests.put_nowait((request, client_address, None))
+        except queue.Full:
+            try:
+                request.sendall(
+                    b"HTTP/1.1 503 Service Unavailable\r\n"
+                    b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+                )
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        """Stop the worker threads and close the server."""
+        super().server_close()
+        self._stopping.set()
+        self._wakeup.send(b"\0")
+        self._idle_watcher.join()
+        self._waker.close()
+        self._wakeup.close()
+
+        for _ in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join()
+
+        # connections kept alive after the selector thread stopped
+        for request, *_ in self._idle:
+            self.shutdown_request(request)
+
+
+def serve(
+    app: API,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    workers: int = 8,
+    queue_size: int = 64,
+    event_version: str = "1.0",
+    keep_alive_timeout: float = 5,
+) -> None:
+    """Serve the API until interrupted."""
+    server = ThreadPoolHTTPServer(
+        (host, port),
+        app,
+        workers=workers,
+        queue_size=queue_size,
+        event_version=event_version,
+        keep_alive_timeout=keep_alive_timeout,
+    )
+    print(f"Serving {app.name} at http://{host}:{port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _import_app(path: str) -> API:
+    """Import an API object from a `module:attribute` path."""
+    module_name, _, attribute = path.partition(":")
+    sys.path.insert(0, ".")
+    module = importlib.import_module(module_name)
+    return getattr(module, attribute or "app")
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    """Run local server."""
+    parser = argparse.ArgumentParser(description="Serve a lambda-proxy API locally")
+    parser.add_argument("app", help="API to serve as `module:attribute`")
+    parser.add_argument("--host", default="127.0.0.1", help="host")
+    parser.add_argument("--port", type=int, default=8000, help="port")
+    parser.add_argument("--workers", type=int, default=8, help="worker threads")
+    parser.add_argument(
+        "--queue-size", type=int, default=64, help="maximum waiting connections"
+    )
+    parser.add_argument(
+        "--event-version",
+        choices=["1.0", "2.0"],
+        default="1.0",
+        help="API Gateway event payload format",
+    )
+    parser.add_argument(
+        "--keep-alive-timeout",
+        type=float,
+        default=5,
+        help="close idle keep-alive connections after (in seconds)",
+    )
+    options = parser.parse_args(args)
+
+    serve(
+        _import_app(options.app),
+        host=options.host,
+        port=options.port,
+        workers=options.workers,
+        queue_size=options.queue_size,
+        event_version=options.event_version,
+        keep_alive_timeout=options.keep_alive_timeout,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Test lambda-proxy caches."""
+
+import os
+
+import pytest
+
+from lambda_proxy.cache import (
+    DiskCache,
+    LRUCache,
+    MemoryCache,
+    ResponseCache,
+    TieredCache,
+)
+
+
+def test_LRUCache():
+    """Should evict least recently used entries."""
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert len(cache) == 2
+    assert not cache.get("b")
+    assert cache.get("c") == 3
+    assert cache.info() == {"hits": 2, "misses": 1, "size": 2, "maxsize": 2}
+
+    cache.clear()
+    assert not len(cache)
+    assert not cache.get("a")
+
+    with pytest.raises(ValueError):
+        LRUCache(0)
+
+
+def test_MemoryCache():
+    """Should evict entries by count, size and time to live."""
+    cache = MemoryCache(max_entries=2, max_bytes=10)
+    cache.set("a", 1, 4)
+    cache.set("b", 2, 4)
+    assert cache.bytes == 8
+    assert cache.get("a") == 1
+
+    # evicted by size
+    cache.set("c", 3, 4)
+    assert not cache.get("b")
+    assert cache.bytes == 8
+    assert cache.evictions == 1
+
+    # evicted by count
+    cache.set("d", 4, 1)
+    assert not cache.get("a")
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+    # too large
+    cache.set("e", 5, 11)
+    assert not cache.get("e")
+
+    cache.set("f", 6, 1, ttl=-1)
+    assert not cache.get("f")
+
+    info = cache.info()
+    assert info["hits"] == 2
+    assert info["misses"] == 4
+    assert info["evictions"] == 3
+
+    cache.clear()
+    assert not len(cache)
+    assert not cache.bytes
+
+
+def test_ResponseCache():
+    """Should key responses and copy cached messages."""
+    cache = ResponseCache(query_params=["a"], ttl=10)
+    key = cache.get_key("/<id>", {"id": "1"}, {"a": "1", "b": "2"}, "gzip")
+    assert key == ("/<id>", (("id", "1"),), (("a", "1"),), "gzip")
+    assert cache.get_key("/<id>", {"id": "1"}, {"a": "1"}, "gzip") == key
+
+    message = {
+        "statusCode": 200,
+        "headers": {"Content-Type": "text/plain"},
+        "body": "yo",
+    }
+    cache.set(key, message)
+    res = cache.get(key)
+    assert res == message
+    res["headers"]["ETag"] = "yo"
+    assert "ETag" not in cache.get(key)["headers"]
+    assert cache.info()["bytes"] == 2
+
+
+def test_DiskCache(tmpdir):
+    """Should store bodies in content-addressed files."""
+    cache = DiskCache(str(tmpdir), max_bytes=10)
+    message = {"statusCode": 200, "headers": {}, "body": "aaaa"}
+    cache.set("a", message, ttl=10)
+    cache.set("b", dict(message), ttl=10)
+    assert cache.info()["files"] == 1
+    assert cache.bytes == 4
+    assert len(os.listdir(str(tmpdir))) == 1
+
+    assert cache.get("a") == message
+    res, ttl = cache.get_entry("b")
+    assert res == message
+    assert 0 < ttl <= 10
+
+    binary = {"statusCode": 200, "headers": {}, "body": b"bbbbbb"}
+    cache.set("c", binary)
+    assert cache.get("c") == binary
+    assert cache.bytes == 10
+
+    # evicting "a" does not free the file shared with "b"
+    cache.set("d", {"statusCode": 200, "headers": {}, "body": b"d"})
+    assert not cache.get("a")
+    assert not cache.get("b")
+    assert cache.bytes == 7
+    assert cache.evictions == 2
+
+    cache.set("e", {"statusCode": 200, "headers": {}, "body": b"e"})
+    assert cache.bytes == 8
+    assert len(os.listdir(str(tmpdir))) == 3
+
+    cache.set("f", binary, ttl=-1)
+    assert not cache.get("f")
+
+    # file removed by someone else
+    cache.set("g", {"statusCode": 200, "headers": {}, "body": b"g"})
+    os.remove(os.path.join(str(tmpdir), cache._data["g"][1]))
+    assert not cache.get("g")
+
+    cache.clear()
+    assert not len(cache)
+    assert not cache.bytes
+    assert not os.listdir(str(tmpdir))
+
+
+def test_TieredCache(tmpdir):
+    """Should keep small bodies in memory and large bodies on disk."""
+    cache = TieredCache(
+        MemoryCache(),
+        DiskCache(str(tmpdir)),
+        memory_item_max_bytes=4,
+    )
+    small = {"statusCode": 200, "headers": {}, "body": b"a"}
+    large = {"statusCode": 200, "headers": {}, "body": b"aaaaaaaa"}
+    cache.set("small", small, 1, ttl=10)
+    cache.set("large", large, 8, ttl=10)
+    assert len(cache.memory) == 1
+    assert len(cache.disk) == 2
+
+    assert cache.get("small") == small
+    assert cache.get("large") == large
+    assert cache.info()["memory"]["hits"] == 1
+    assert cache.info()["disk"]["hits"] == 1
+
+    # promote disk hits
+    cache.memory.clear()
+    assert cache.get("small") == small
+    assert len(cache.memory) == 1
+
+    cache.clear()
+    assert not cache.get("small")
+
+    response_cache = ResponseCache(backend=cache)
+    assert response_cache.backend == cache
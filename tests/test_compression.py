@@ -0,0 +1,78 @@
+"""tests lambda_proxy.compression."""
+
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from lambda_proxy import compression
+
+
+@pytest.mark.parametrize(
+    "name,wbits", [("gzip", zlib.MAX_WBITS | 16), ("zlib", 15), ("deflate", -15)]
+)
+def test_zlib_codecs(name, wbits):
+    """Should compress with zlib codecs."""
+    body = b"heyyyy" * 100
+    codec = compression.default_codecs[name]
+    assert codec.name == name
+    assert zlib.decompress(codec.compress(body, 6), wbits) == body
+
+    compressor = codec.compressobj(1)
+    data = compressor.compress(body[:300]) + compressor.compress(body[300:])
+    data += compressor.flush()
+    assert zlib.decompress(data, wbits) == body
+
+
+def test_scale_level():
+    """Should map zlib levels to other codecs levels."""
+    assert compression._scale_level(9, 0, 11) == 11
+    assert compression._scale_level(0, 0, 11) == 0
+    assert compression._scale_level(0, 1, 19) == 1
+    assert compression._scale_level(6, 1, 19) == 13
+
+
+@pytest.mark.skipif(compression.brotli is None, reason="brotli is not installed")
+def test_brotli_codec():
+    """Should compress with brotli."""
+    body = b"heyyyy" * 100
+    codec = compression.default_codecs["br"]
+    assert compression.brotli.decompress(codec.compress(body, 6)) == body
+
+
+@pytest.mark.skipif(compression.zstandard is None, reason="zstandard is not installed")
+def test_zstd_codec():
+    """Should compress with zstandard."""
+    body = b"heyyyy" * 100
+    codec = compression.default_codecs["zstd"]
+    decompressor = compression.zstandard.ZstdDecompressor()
+    assert decompressor.decompress(codec.compress(body, 6)) == body
+
+
+@pytest.mark.parametrize(
+    "name,wbits", [("gzip", zlib.MAX_WBITS | 16), ("zlib", 15), ("deflate", -15)]
+)
+@pytest.mark.parametrize("level", [0, 1, 6, 9])
+def test_parallel_compress(name, wbits, level):
+    """Should compress by blocks to a single valid stream."""
+    body = b"".join(str(i).encode() * 3 for i in range(20000))
+    codec = compression.default_codecs[name]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        data = codec.parallel_compress(body, level, executor, 16 * 1024)
+        assert zlib.decompress(data, wbits) == body
+
+        data = codec.parallel_compress(bytearray(body), level, executor, 16 * 1024)
+        assert zlib.decompress(data, wbits) == body
+
+        data = codec.parallel_compress(b"", level, executor)
+        assert zlib.decompress(data, wbits) == b""
+
+
+def test_parallel_deflate_ratio():
+    """Should keep compression ratio using previous blocks as dictionary."""
+    body = b"".join(str(i).encode() * 3 for i in range(20000))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        data = compression.parallel_deflate(body, 6, executor, 16 * 1024)
+
+    reference = compression.default_codecs["deflate"].compress(body, 6)
+    assert len(data) < len(reference) * 1.05
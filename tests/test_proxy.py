@@ -1,16 +1,23 @@
 """Test lambda-proxy."""
 
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
 
 import os
 import json
 import zlib
+import array
 import base64
+import asyncio
+import warnings
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 from mock import Mock
 
 from lambda_proxy import proxy
+from lambda_proxy.cache import ResponseCache, TieredCache
 
 json_api = os.path.join(os.path.dirname(__file__), "fixtures", "openapi.json")
 with open(json_api, "r") as f:
@@ -94,6 +101,14 @@ def test_RouteEntry_Options():
     assert route.b64encode
 
 
+def test_RouteEntry_compiledPath():
+    """Should precompile route regex and path arguments."""
+    route = proxy.RouteEntry(funct, "/endpoint/<string:user>/<int:z>/<float:x>.<ext>")
+    assert route.route_expr.pattern == route.route_regex
+    assert route.arg_names == ["user", "z", "x", "ext"]
+    assert route.arg_converters == [str, int, float, str]
+
+
 def test_RouteEntry_invalidCompression():
     """Should work as expected."""
     with pytest.raises(ValueError):
@@ -164,6 +179,13 @@ def test_API_addRoute():
     with pytest.raises(ValueError):
         app._add_route("/endpoint/test/<id>", funct, methods=["GET"], cors=True)
 
+    with pytest.raises(ValueError):
+        app._add_route("/endpoint/test/<id>", funct, methods=["POST", "GET"])
+
+    app._add_route("/endpoint/test/<id>", funct, methods=["POST"])
+    assert app._registry["GET"]["/endpoint/test/<id>"].methods == ["GET"]
+    assert app._registry["POST"]["/endpoint/test/<id>"].methods == ["POST"]
+
     with pytest.raises(TypeError):
         app._add_route("/endpoint/test/<id>", funct, methods=["GET"], c=True)
 
@@ -524,7 +546,7 @@ def test_API_compression():
     gzbody = gzip_compress.compress(body) + gzip_compress.flush()
     b64gzipbody = base64.b64encode(gzbody).decode()
 
-    app = proxy.API(name="test")
+    app = proxy.API(name="test", incompressible_types=[])
     funct = Mock(__name__="Mock", return_value=("OK", "image/jpeg", body))
     app._add_route(
         "/test_compress/<user>.jpg",
@@ -549,6 +571,7 @@ def test_API_compression():
             "Access-Control-Allow-Origin": "*",
             "Content-Encoding": "gzip",
             "Content-Type": "image/jpeg",
+            "Vary": "Accept-Encoding",
         },
         "statusCode": 200,
     }
@@ -569,6 +592,7 @@ def test_API_compression():
             "Access-Control-Allow-Methods": "GET",
             "Access-Control-Allow-Origin": "*",
             "Content-Type": "image/jpeg",
+            "Vary": "Accept-Encoding",
         },
         "statusCode": 200,
     }
@@ -598,6 +622,7 @@ def test_API_compression():
             "Access-Control-Allow-Origin": "*",
             "Content-Encoding": "gzip",
             "Content-Type": "image/jpeg",
+            "Vary": "Accept-Encoding",
         },
         "isBase64Encoded": True,
         "statusCode": 200,
@@ -637,6 +662,7 @@ def test_API_compression():
             "Access-Control-Allow-Origin": "*",
             "Content-Encoding": "gzip",
             "Content-Type": "application/json",
+            "Vary": "Accept-Encoding",
         },
         "isBase64Encoded": True,
         "statusCode": 200,
@@ -658,6 +684,7 @@ def test_API_compression():
             "Access-Control-Allow-Methods": "GET",
             "Access-Control-Allow-Origin": "*",
             "Content-Type": "application/json",
+            "Vary": "Accept-Encoding",
         },
         "statusCode": 200,
     }
@@ -674,7 +701,7 @@ def test_API_otherCompression():
     zlibbody = zlib_compress.compress(body) + zlib_compress.flush()
     deflbody = deflate_compress.compress(body) + deflate_compress.flush()
 
-    app = proxy.API(name="test")
+    app = proxy.API(name="test", incompressible_types=[])
     funct = Mock(__name__="Mock", return_value=("OK", "image/jpeg", body))
     app._add_route(
         "/test_deflate/<user>.jpg",
@@ -706,6 +733,7 @@ def test_API_otherCompression():
             "Access-Control-Allow-Origin": "*",
             "Content-Encoding": "zlib",
             "Content-Type": "image/jpeg",
+            "Vary": "Accept-Encoding",
         },
         "statusCode": 200,
     }
@@ -727,6 +755,7 @@ def test_API_otherCompression():
             "Access-Control-Allow-Origin": "*",
             "Content-Encoding": "deflate",
             "Content-Type": "image/jpeg",
+            "Vary": "Accept-Encoding",
         },
         "statusCode": 200,
     }
@@ -775,9 +804,9 @@ def test_API_routeURL():
         "queryStringParameters": {},
     }
     resp = {
-        "body": '{"errorMessage": "No view function for: POST - /test/remotepixel"}',
-        "headers": {"Content-Type": "application/json"},
-        "statusCode": 400,
+        "body": '{"errorMessage": "Method not allowed for: POST - /test/remotepixel"}',
+        "headers": {"Content-Type": "application/json", "Allow": "GET"},
+        "statusCode": 405,
     }
     res = app(event, {})
     assert res == resp
@@ -1204,6 +1233,7 @@ def test_API_doc():
     res = app(event, {})
     body = json.loads(res["body"])
     assert res["statusCode"] == 200
+    headers["ETag"] = proxy._get_etag(res["body"])
     assert res["headers"] == headers
     assert openapi_content == body
 
@@ -1218,10 +1248,12 @@ def test_API_doc():
         "Access-Control-Allow-Methods": "GET",
         "Access-Control-Allow-Origin": "*",
         "Content-Type": "text/html",
+        "Cache-Control": "public, max-age=86400",
     }
 
     res = app(event, {})
     assert res["statusCode"] == 200
+    headers["ETag"] = proxy._get_etag(res["body"])
     assert res["headers"] == headers
 
     event = {
@@ -1235,10 +1267,12 @@ def test_API_doc():
         "Access-Control-Allow-Methods": "GET",
         "Access-Control-Allow-Origin": "*",
         "Content-Type": "text/html",
+        "Cache-Control": "public, max-age=86400",
     }
 
     res = app(event, {})
     assert res["statusCode"] == 200
+    headers["ETag"] = proxy._get_etag(res["body"])
     assert res["headers"] == headers
 
     # Clear logger handlers
@@ -1306,6 +1340,7 @@ def test_API_doc_apigw():
     res = app(event, {})
     body = json.loads(res["body"])
     assert res["statusCode"] == 200
+    headers["ETag"] = proxy._get_etag(res["body"])
     assert res["headers"] == headers
     assert openapi_apigw_content == body
 
@@ -1321,10 +1356,12 @@ def test_API_doc_apigw():
         "Access-Control-Allow-Methods": "GET",
         "Access-Control-Allow-Origin": "*",
         "Content-Type": "text/html",
+        "Cache-Control": "public, max-age=86400",
     }
 
     res = app(event, {})
     assert res["statusCode"] == 200
+    headers["ETag"] = proxy._get_etag(res["body"])
     assert res["headers"] == headers
 
     # Clear logger handlers
@@ -1393,6 +1430,7 @@ def test_API_docCustomDomain():
     res = app(event, {})
     body = json.loads(res["body"])
     assert res["statusCode"] == 200
+    headers["ETag"] = proxy._get_etag(res["body"])
     assert res["headers"] == headers
     assert openapi_custom_content == body
 
@@ -1741,3 +1779,1367 @@ def test_API_simpleRoute():
     # Clear logger handlers
     for h in app.log.handlers:
         app.log.removeHandler(h)
+
+
+@pytest.mark.parametrize("router", ["linear", "trie", "alternation"])
+def test_API_routers(router):
+    """Should match routes in registration order with every router."""
+    app = proxy.API(name="test", router=router)
+    user = Mock(__name__="Mock", return_value=("OK", "text/plain", "user"))
+    people = Mock(__name__="Mock", return_value=("OK", "text/plain", "people"))
+    tile = Mock(__name__="Mock", return_value=("OK", "text/plain", "tile"))
+    anything = Mock(__name__="Mock", return_value=("OK", "text/plain", "anything"))
+    app._add_route("/<user>", user, methods=["GET"])
+    app._add_route("/<user>/<int:num>", user, methods=["GET"])
+    app._add_route("/people", people, methods=["GET", "POST"])
+    if router == "alternation":
+        # static routes don't compile the router patterns
+        assert not app._router.expressions
+    app._add_route("/tiles/<int:z>/<int:x>/<int:y>.<ext>", tile, methods=["GET"])
+    app._add_route("/files/<regex(.+):path>", anything, methods=["GET"])
+
+    assert app._url_matching("/people", "GET").endpoint == user
+    assert app._url_matching("/people", "POST").endpoint == people
+    assert app._url_matching("/tiles/1/2/3.png", "GET").endpoint == tile
+    assert app._url_matching("/tiles/a/2/3.png", "GET") is None
+    assert app._url_matching("/files/a/b/c.txt", "GET").endpoint == anything
+    assert not app._url_matching("/files/a/b/c.txt", "POST")
+
+    route = app._url_matching("/tiles/1/2/3.png", "GET")
+    assert app._get_matching_args(route, "/tiles/1/2/3.png") == {
+        "z": 1,
+        "x": 2,
+        "y": 3,
+        "ext": "png",
+    }
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_invalidRouter():
+    """Should raise an error for unknown router."""
+    with pytest.raises(ValueError):
+        proxy.API(name="test", router="nope")
+
+
+@pytest.mark.parametrize("router", ["trie", "linear", "alternation"])
+def test_API_staticRoutes(router):
+    """Should index static routes."""
+    app = proxy.API(name="test", router=router)
+    assert app._static_routes[("GET", "/openapi.json")] == app.routes[0]
+
+    user = Mock(__name__="Mock", return_value=("OK", "text/plain", "user"))
+    people = Mock(__name__="Mock", return_value=("OK", "text/plain", "people"))
+    health = Mock(__name__="Mock", return_value=("OK", "text/plain", "health"))
+    app._add_route("/health", health, methods=["GET"])
+    app._add_route("/<user>", user, methods=["GET"])
+    app._add_route("/<user>/<int:num>", user, methods=["GET"])
+    app._add_route("/people", people, methods=["GET", "POST"])
+    if router == "alternation":
+        # static routes don't compile the router patterns
+        assert not app._router.expressions
+
+    assert app._url_matching("/health", "GET").endpoint == health
+    assert app._url_matching("/healthy", "GET").endpoint == user
+    # `/<user>` was registered first so it wins for GET
+    assert app._static_routes[("GET", "/people")].endpoint == user
+    assert app._url_matching("/people", "GET").endpoint == user
+    assert app._url_matching("/people", "POST").endpoint == people
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_routeCache():
+    """Should cache resolved routes and path arguments."""
+    app = proxy.API(name="test", route_cache_size=2)
+    funct = Mock(__name__="Mock", return_value=("OK", "text/plain", "heyyyy"))
+    app._add_route("/test/<string:user>/<int:num>", funct, methods=["GET"])
+    assert not len(app.route_cache)
+
+    event = {
+        "path": "/test/remote/1",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {"num": "2"},
+    }
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    # query parameters don't override path arguments
+    funct.assert_called_with(user="remote", num=1)
+
+    event["queryStringParameters"] = {}
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    funct.assert_called_with(user="remote", num=1)
+    assert app.route_cache.info()["hits"] == 1
+    assert app.route_cache.info()["misses"] == 1
+
+    res = app(dict(event, path="/test/remote/a"), {})
+    assert res["statusCode"] == 400
+    assert len(app.route_cache) == 1
+
+    app._add_route("/other", funct, methods=["GET"])
+    assert not len(app.route_cache)
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_ArgumentBinder():
+    """Should bind and convert query parameters."""
+
+    def endpoint(
+        user: str,
+        num: int = 1,
+        opt: float = 2.0,
+        flag: bool = False,
+        values: List[int] = None,
+        names: list = None,
+        zoom=0,
+        other=None,
+    ):
+        pass
+
+    binder = proxy.ArgumentBinder(endpoint)
+    assert not binder.var_keyword
+    assert binder.names == set(
+        ["user", "num", "opt", "flag", "values", "names", "zoom", "other"]
+    )
+
+    kwargs = binder.bind(
+        {"user": "remote"},
+        {
+            "num": "3",
+            "opt": "0.5",
+            "flag": "true",
+            "values": "1,2",
+            "names": "a",
+            "zoom": "10",
+            "other": "yo",
+            "unknown": "yo",
+        },
+        {"names": ["a", "b"]},
+    )
+    assert kwargs == {
+        "user": "remote",
+        "num": 3,
+        "opt": 0.5,
+        "flag": True,
+        "values": [1, 2],
+        "names": ["a", "b"],
+        "zoom": "10",
+        "other": "yo",
+    }
+
+    # unannotated arguments receive the query string values
+    assert binder.bind({}, {"zoom": "nan", "other": ""}) == {
+        "zoom": "nan",
+        "other": "",
+    }
+
+    # path arguments are not overridden
+    assert binder.bind({"user": "remote", "num": 2}, {"num": "abc"}) == {
+        "user": "remote",
+        "num": 2,
+    }
+
+    with pytest.raises(ValueError):
+        binder.bind({}, {"num": "a"})
+
+    with pytest.raises(ValueError):
+        binder.bind({}, {"flag": "maybe"})
+
+    def endpoint_kwargs(user: str, **kwargs):
+        pass
+
+    def endpoint_noargs():
+        pass
+
+    binder = proxy.ArgumentBinder(endpoint_noargs)
+    assert not binder.var_keyword
+    assert binder.bind({}, {"unknown": "yo"}) == {}
+
+    binder = proxy.ArgumentBinder(endpoint_kwargs)
+    assert binder.var_keyword
+    assert binder.bind({"user": "remote"}, {"unknown": "yo"}) == {
+        "user": "remote",
+        "unknown": "yo",
+    }
+
+
+def test_API_queryParams():
+    """Should filter and convert query parameters."""
+    app = proxy.API(name="test")
+
+    @app.get("/<user>")
+    def _user(user: str, num: int = 0) -> Tuple[str, str, str]:
+        """Return something."""
+        return ("OK", "application/json", json.dumps({"user": user, "num": num}))
+
+    event = {
+        "path": "/remotepixel",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {"num": "2", "unknown": "yo"},
+    }
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert json.loads(res["body"]) == {"user": "remotepixel", "num": 2}
+
+    event["queryStringParameters"] = {"num": "yo"}
+    res = app(event, {})
+    assert res["statusCode"] == 400
+    assert json.loads(res["body"]) == {"errorMessage": "Invalid value for 'num': yo"}
+
+    @app.get("/ping/status")
+    def _ping() -> Tuple[str, str, str]:
+        """Return something."""
+        return ("OK", "text/plain", "pong")
+
+    event = {
+        "path": "/ping/status",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {"v": "2"},
+    }
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert res["body"] == "pong"
+
+    event["path"] = "/openapi.json"
+    res = app(event, {})
+    assert res["statusCode"] == 200
+
+    @app.get("/values/<int:x>")
+    def _values(x: int, nodata=0, flag=False) -> Tuple[str, str, str]:
+        """Return something."""
+        return ("OK", "application/json", json.dumps([x, nodata, flag]))
+
+    event = {
+        "path": "/values/1",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {"x": "abc", "nodata": "nan", "flag": ""},
+    }
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert json.loads(res["body"]) == [1, "nan", ""]
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_openapiCache():
+    """Should cache OpenAPI document per prefix."""
+    app = proxy.API(name="test")
+
+    event = {
+        "path": "/openapi.json",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {},
+    }
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    etag = res["headers"]["ETag"]
+    assert list(app._openapi_cache) == [""]
+    assert app._openapi_cache[""] == (res["body"], etag)
+
+    event["headers"] = {"If-None-Match": etag}
+    res = app(event, {})
+    assert res["statusCode"] == 304
+    assert res["headers"]["ETag"] == etag
+    assert not res["body"]
+
+    event["headers"] = {"If-None-Match": '"yo", W/' + etag}
+    res = app(event, {})
+    assert res["statusCode"] == 304
+
+    event = {
+        "resource": "/{proxy+}",
+        "pathParameters": {"proxy": "openapi.json"},
+        "path": "/api/openapi.json",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {},
+    }
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert sorted(app._openapi_cache) == ["", "/api"]
+
+    @app.get("/yo")
+    def _yo() -> Tuple[str, str, str]:
+        """Return something."""
+        return ("OK", "text/plain", "yo")
+
+    assert not app._openapi_cache
+    res = app(event, {})
+    assert "/api/yo" in json.loads(res["body"])["paths"]
+    assert res["headers"]["ETag"] != etag
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_docsCache():
+    """Should pre-render and compress documentation pages."""
+    app = proxy.API(name="test", compress_docs=True)
+
+    event = {
+        "path": "/docs",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {},
+    }
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    html = res["body"]
+    etag = res["headers"]["ETag"]
+    assert "<title>test - Swagger UI</title>" in html
+    assert res["headers"]["Cache-Control"] == "public, max-age=86400"
+    assert list(app._docs_cache) == [("Swagger UI", "")]
+
+    event["headers"] = {"Accept-Encoding": "gzip, deflate"}
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert res["isBase64Encoded"]
+    assert res["headers"]["Content-Encoding"] == "gzip"
+    assert res["headers"]["ETag"] != etag
+    body = base64.b64decode(res["body"])
+    assert zlib.decompress(body, zlib.MAX_WBITS | 16).decode() == html
+
+    event["headers"] = {"Accept-Encoding": "gzip;q=0, deflate"}
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert not res.get("isBase64Encoded")
+    assert "Content-Encoding" not in res["headers"]
+    assert res["body"] == html
+
+    event["headers"] = {"If-None-Match": etag}
+    res = app(event, {})
+    assert res["statusCode"] == 304
+    assert res["headers"]["Cache-Control"] == "public, max-age=86400"
+    assert not res["body"]
+
+    event = {
+        "path": "/redoc",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {},
+    }
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert "<title>test - ReDoc</title>" in res["body"]
+    assert ("ReDoc", "") in app._docs_cache
+
+    # Not compressed by default
+    app = proxy.API(name="test")
+    event["headers"] = {"Accept-Encoding": "gzip, deflate"}
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert not res.get("isBase64Encoded")
+    assert "Content-Encoding" not in res["headers"]
+    assert "Vary" not in res["headers"]
+    assert "<title>test - ReDoc</title>" in res["body"]
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_responseCache():
+    """Should cache route responses."""
+    app = proxy.API(name="test")
+    funct = Mock(__name__="Mock", return_value=("OK", "text/plain", "heyyyy"))
+    app._add_route(
+        "/test/<user>",
+        funct,
+        methods=["GET"],
+        cache=proxy.ResponseCache(query_params=["size"]),
+        cache_control="public,max-age=3600",
+        payload_compression_method="gzip",
+    )
+
+    event = {
+        "path": "/test/remotepixel",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {"size": "256", "other": "1"},
+    }
+    res = app(event, {})
+    assert res["body"] == "heyyyy"
+    assert funct.call_count == 1
+
+    event["queryStringParameters"] = {"size": "256", "other": "2"}
+    assert app(event, {}) == res
+    assert funct.call_count == 1
+
+    event["queryStringParameters"] = {"size": "512"}
+    assert app(event, {}) == res
+    assert funct.call_count == 2
+
+    event["headers"] = {"Accept-Encoding": "gzip"}
+    res = app(event, {})
+    assert res["headers"]["Content-Encoding"] == "gzip"
+    assert funct.call_count == 3
+
+    route = app.routes[-1]
+    assert route.cache_ttl == 3600
+    assert route.cache.info()["hits"] == 1
+    assert route.cache.info()["misses"] == 3
+
+    funct_error = Mock(__name__="Mock", return_value=("NOK", "text/plain", "yo"))
+    app._add_route("/error", funct_error, cache=True, cache_control="max-age=10")
+    event = {"path": "/error", "httpMethod": "GET", "headers": {}}
+    app(event, {})
+    app(event, {})
+    assert funct_error.call_count == 2
+
+    with pytest.raises(ValueError):
+        app._add_route("/nocache", funct, cache=True)
+
+    with pytest.raises(ValueError):
+        app._add_route("/nocache", funct, cache=True, cache_control="no-store")
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_etag():
+    """Should add ETag header and return 304 Not Modified responses."""
+    app = proxy.API(name="test")
+    funct = Mock(__name__="Mock", return_value=("OK", "text/plain", "heyyyy"))
+    app._add_route("/test", funct, etag=True, cache_control="public,max-age=3600")
+
+    event = {"path": "/test", "httpMethod": "GET", "headers": {}}
+    res = app(event, {})
+    etag = proxy._get_etag("heyyyy")
+    assert res["statusCode"] == 200
+    assert res["headers"]["ETag"] == etag
+
+    event["headers"] = {"If-None-Match": etag}
+    res = app(event, {})
+    assert res == {
+        "statusCode": 304,
+        "headers": {
+            "Content-Type": "text/plain",
+            "Cache-Control": "public,max-age=3600",
+            "ETag": etag,
+        },
+        "body": "",
+    }
+
+    event["headers"] = {"If-None-Match": '"other"'}
+    assert app(event, {})["statusCode"] == 200
+
+    # Routes without ETag option
+    funct_noetag = Mock(__name__="Mock", return_value=("OK", "text/plain", "heyyyy"))
+    app._add_route("/noetag", funct_noetag)
+    event = {"path": "/noetag", "httpMethod": "GET", "headers": {"If-None-Match": etag}}
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert not res["headers"].get("ETag")
+
+    # Endpoint Last-Modified header
+    last_modified = "Wed, 21 Oct 2015 07:28:00 GMT"
+    funct_modified = Mock(
+        __name__="Mock",
+        return_value=("OK", "text/plain", "heyyyy", {"Last-Modified": last_modified}),
+    )
+    app._add_route("/modified", funct_modified, etag=True)
+    event = {
+        "path": "/modified",
+        "httpMethod": "GET",
+        "headers": {"If-Modified-Since": "Thu, 22 Oct 2015 07:28:00 GMT"},
+    }
+    assert app(event, {})["statusCode"] == 304
+
+    event["headers"] = {"If-Modified-Since": "Tue, 20 Oct 2015 07:28:00 GMT"}
+    assert app(event, {})["statusCode"] == 200
+
+    event["headers"] = {"If-Modified-Since": "not a date"}
+    assert app(event, {})["statusCode"] == 200
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_etagValidator():
+    """Should not call the endpoint when the validator matches."""
+    app = proxy.API(name="test")
+    funct = Mock(__name__="Mock", return_value=("OK", "text/plain", "heyyyy"))
+    validator = Mock(return_value="v1")
+    app._add_route("/test/<user>", funct, etag=validator)
+
+    event = {
+        "path": "/test/remotepixel",
+        "httpMethod": "GET",
+        "headers": {"Accept-Encoding": "gzip"},
+    }
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert res["headers"]["ETag"] == 'W/"v1"'
+    validator.assert_called_with(user="remotepixel")
+    assert funct.call_count == 1
+
+    event["headers"]["If-None-Match"] = '"v1"'
+    res = app(event, {})
+    assert res["statusCode"] == 304
+    assert res["headers"]["ETag"] == 'W/"v1"'
+    assert res["body"] == ""
+    assert funct.call_count == 1
+
+    validator.return_value = "v2"
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert res["headers"]["ETag"] == 'W/"v2"'
+    assert funct.call_count == 2
+
+    # Validator errors fall back to the response body ETag
+    validator.side_effect = Exception("nope")
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert res["headers"]["ETag"] == proxy._get_etag(res["body"])
+    assert funct.call_count == 3
+
+    # Cached responses keep the validator ETag
+    funct_cached = Mock(__name__="Mock", return_value=("OK", "text/plain", "heyyyy"))
+    app._add_route(
+        "/cached",
+        funct_cached,
+        etag=lambda: '"abc"',
+        cache=True,
+        cache_control="max-age=10",
+    )
+    event = {"path": "/cached", "httpMethod": "GET", "headers": {}}
+    assert app(event, {})["headers"]["ETag"] == 'W/"abc"'
+    assert app(event, {})["headers"]["ETag"] == 'W/"abc"'
+    assert funct_cached.call_count == 1
+
+    event["headers"] = {"If-None-Match": 'W/"abc"'}
+    assert app(event, {})["statusCode"] == 304
+
+    # Async validators are awaited on the API event loop
+    async def async_validator(user):
+        await asyncio.sleep(0)
+        return f"{user}-v3"
+
+    funct_async = Mock(__name__="Mock", return_value=("OK", "text/plain", "heyyyy"))
+    app._add_route("/async/<user>", funct_async, etag=async_validator)
+    event = {"path": "/async/remotepixel", "httpMethod": "GET", "headers": {}}
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        res = app(event, {})
+    assert res["headers"]["ETag"] == 'W/"remotepixel-v3"'
+
+    event["headers"] = {"If-None-Match": 'W/"remotepixel-v3"'}
+    assert app(event, {})["statusCode"] == 304
+    assert funct_async.call_count == 1
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_etagUnsafeMethods():
+    """Should always call the endpoint of non GET/HEAD requests."""
+    app = proxy.API(name="test")
+    funct = Mock(__name__="Mock", return_value=("OK", "text/plain", "heyyyy"))
+    validator = Mock(return_value="v1")
+    app._add_route("/validator", funct, methods=["POST"], etag=validator)
+    app._add_route("/etag", funct, methods=["POST"], etag=True)
+
+    event = {
+        "path": "/validator",
+        "httpMethod": "POST",
+        "headers": {"If-None-Match": 'W/"v1"'},
+    }
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert res["body"] == "heyyyy"
+    assert funct.call_count == 1
+    validator.assert_not_called()
+
+    event["path"] = "/etag"
+    event["headers"] = {"If-None-Match": proxy._get_etag("heyyyy")}
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert res["body"] == "heyyyy"
+    assert funct.call_count == 2
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_incompressibleTypes():
+    """Should not compress incompressible or small responses."""
+    app = proxy.API(name="test", compression_min_size=10)
+    assert "image/png" in app.incompressible_types
+
+    png = Mock(__name__="Mock", return_value=("OK", "image/png", b"fakepngbody"))
+    app._add_route("/test.png", png, payload_compression_method="gzip")
+    video = Mock(__name__="Mock", return_value=("OK", "video/mp4", b"fakevideobody"))
+    app._add_route("/test.mp4", video, payload_compression_method="gzip")
+    small = Mock(__name__="Mock", return_value=("OK", "application/json", "{}"))
+    app._add_route("/small.json", small, payload_compression_method="gzip")
+    text = Mock(
+        __name__="Mock",
+        return_value=("OK", "text/plain; charset=utf-8", "heyyyyyyyyyyyy"),
+    )
+    app._add_route("/test.txt", text, payload_compression_method="gzip")
+
+    event = {"path": "/test.png", "httpMethod": "GET", "headers": {}}
+    event["headers"] = {"Accept-Encoding": "gzip"}
+    res = app(event, {})
+    assert res["body"] == b"fakepngbody"
+    assert not res["headers"].get("Content-Encoding")
+
+    event["path"] = "/test.mp4"
+    res = app(event, {})
+    assert res["body"] == b"fakevideobody"
+    assert not res["headers"].get("Content-Encoding")
+
+    event["path"] = "/small.json"
+    res = app(event, {})
+    assert res["body"] == "{}"
+    assert not res["headers"].get("Content-Encoding")
+
+    event["path"] = "/test.txt"
+    res = app(event, {})
+    assert res["headers"]["Content-Encoding"] == "gzip"
+    assert zlib.decompress(res["body"], zlib.MAX_WBITS | 16) == b"heyyyyyyyyyyyy"
+
+    app = proxy.API(name="test", incompressible_types=["text/plain"])
+    app._add_route("/test.png", png, payload_compression_method="gzip")
+    app._add_route("/test.txt", text, payload_compression_method="gzip")
+    event = {"path": "/test.png", "httpMethod": "GET", "headers": event["headers"]}
+    assert app(event, {})["headers"]["Content-Encoding"] == "gzip"
+    event["path"] = "/test.txt"
+    assert not app(event, {})["headers"].get("Content-Encoding")
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_get_compression_level():
+    """Should select compression level from body size and remaining time."""
+    assert proxy._get_compression_level(1024) == 9
+    assert proxy._get_compression_level(512 * 1024) == 6
+    assert proxy._get_compression_level(10 * 1024 * 1024) == 4
+
+    assert proxy._get_compression_level(1024, 30000) == 9
+    assert proxy._get_compression_level(512 * 1024, 30000) == 6
+    assert proxy._get_compression_level(512 * 1024, 60) == 4
+    assert proxy._get_compression_level(10 * 1024 * 1024, 1000) == 4
+    assert proxy._get_compression_level(10 * 1024 * 1024, 100) == 1
+
+
+def test_API_compressionLevel():
+    """Should compress with the route compression level."""
+    body = json.dumps({"values": list(range(1000))})
+
+    app = proxy.API(name="test")
+    funct = Mock(__name__="Mock", return_value=("OK", "application/json", body))
+    app._add_route(
+        "/level", funct, payload_compression_method="deflate", compression_level=1
+    )
+    app._add_route(
+        "/auto", funct, payload_compression_method="deflate", compression_level="auto"
+    )
+
+    event = {"path": "/level", "httpMethod": "GET", "headers": {}}
+    event["headers"] = {"Accept-Encoding": "deflate"}
+    deflate_compress = zlib.compressobj(1, zlib.DEFLATED, -zlib.MAX_WBITS)
+    expected = deflate_compress.compress(body.encode()) + deflate_compress.flush()
+    res = app(event, {})
+    assert res["body"] == expected
+
+    # Default context, selected from body size
+    event["path"] = "/auto"
+    deflate_compress = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    expected = deflate_compress.compress(body.encode()) + deflate_compress.flush()
+    res = app(event, {})
+    assert res["body"] == expected
+
+    # Lambda context with low remaining time
+    context = Mock(get_remaining_time_in_millis=Mock(return_value=0))
+    deflate_compress = zlib.compressobj(1, zlib.DEFLATED, -zlib.MAX_WBITS)
+    expected = deflate_compress.compress(body.encode()) + deflate_compress.flush()
+    res = app(event, context)
+    assert res["body"] == expected
+    context.get_remaining_time_in_millis.assert_called_once()
+
+    with pytest.raises(ValueError):
+        app._add_route("/invalid", funct, compression_level=10)
+
+    with pytest.raises(ValueError):
+        app._add_route("/invalid", funct, compression_level="fast")
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_parse_accept_encoding():
+    """Should parse Accept-Encoding header with q-values."""
+    assert proxy._parse_accept_encoding("gzip, deflate") == (
+        ("gzip", 1.0),
+        ("deflate", 1.0),
+    )
+    assert proxy._parse_accept_encoding("GZIP;q=0.5, br; q=1.0, *;q=0, ,") == (
+        ("gzip", 0.5),
+        ("br", 1.0),
+        ("*", 0.0),
+    )
+    assert proxy._parse_accept_encoding("gzip;q=high") == (("gzip", 0.0),)
+
+
+def test_select_compression():
+    """Should select the best mutually supported codec."""
+    assert proxy._select_compression("gzip", "gzip, deflate") == "gzip"
+    assert proxy._select_compression("gzip", "") == ""
+    assert proxy._select_compression("", "gzip") == ""
+    assert proxy._select_compression("gzip", "gzip;q=0, deflate") == ""
+    assert proxy._select_compression("gzip", "x-gzip") == ""
+    assert proxy._select_compression(("gzip", "deflate"), "deflate, gzip") == "gzip"
+    accepted = "gzip;q=0.5, deflate"
+    assert proxy._select_compression(("gzip", "deflate"), accepted) == "deflate"
+    assert proxy._select_compression(("gzip", "deflate"), "*") == "gzip"
+    assert proxy._select_compression(("gzip", "deflate"), "gzip;q=0, *") == "deflate"
+    assert proxy._select_compression(("deflate",), "br, *;q=0.1") == "deflate"
+
+
+def test_API_compressionNegotiation():
+    """Should negotiate compression codec from route preferences."""
+    body = json.dumps({"values": list(range(100))})
+
+    app = proxy.API(name="test")
+    funct = Mock(__name__="Mock", return_value=("OK", "application/json", body))
+    app._add_route("/test", funct, payload_compression_method=["gzip", "deflate"])
+
+    event = {
+        "path": "/test",
+        "httpMethod": "GET",
+        "headers": {"Accept-Encoding": "gzip;q=0.8, deflate"},
+    }
+    res = app(event, {})
+    assert res["headers"]["Content-Encoding"] == "deflate"
+    assert res["headers"]["Vary"] == "Accept-Encoding"
+    assert zlib.decompress(res["body"], -zlib.MAX_WBITS).decode() == body
+
+    event["headers"] = {"Accept-Encoding": "gzip;q=0, deflate;q=0"}
+    res = app(event, {})
+    assert not res["headers"].get("Content-Encoding")
+    assert res["headers"]["Vary"] == "Accept-Encoding"
+    assert res["body"] == body
+
+    with pytest.raises(ValueError):
+        app._add_route("/br", funct, payload_compression_method=["gzip", "br"])
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_registerCodec():
+    """Should compress with registered codecs."""
+    app = proxy.API(name="test")
+    assert {"gzip", "zlib", "deflate"} <= set(app.codecs)
+
+    with pytest.raises(ValueError):
+        app._add_route("/test", funct, payload_compression_method="rev")
+
+    app.register_codec("rev", lambda body, level: body[::-1])
+    assert app.codecs["rev"].compressobj is None
+    assert "rev" not in proxy.API(name="other").codecs
+
+    endpoint = Mock(__name__="Mock", return_value=("OK", "text/plain", "heyyyy"))
+    app._add_route("/test", endpoint, payload_compression_method=["rev", "gzip"])
+    event = {
+        "path": "/test",
+        "httpMethod": "GET",
+        "headers": {"Accept-Encoding": "gzip, rev"},
+    }
+    res = app(event, {})
+    assert res["headers"]["Content-Encoding"] == "rev"
+    assert res["body"] == b"yyyyeh"
+
+    # Unregistered codec
+    del app.codecs["rev"]
+    res = app(event, {})
+    assert res["statusCode"] == 500
+    error = {"errorMessage": "Unsupported compression mode: rev"}
+    assert json.loads(res["body"]) == error
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_compressionCache():
+    """Should cache compressed bodies by content, codec and level."""
+    body = json.dumps({"values": list(range(1000))})
+
+    app = proxy.API(name="test", compression_cache_size=1024 * 1024)
+    funct = Mock(__name__="Mock", return_value=("OK", "application/json", body))
+    app._add_route("/a", funct, payload_compression_method=["gzip", "deflate"])
+    app._add_route("/b", funct, payload_compression_method="gzip")
+    app._add_route("/c", funct, payload_compression_method="gzip", compression_level=1)
+
+    event = {"path": "/a", "httpMethod": "GET", "headers": {}}
+    event["headers"] = {"Accept-Encoding": "gzip"}
+    res = app(event, {})
+    assert zlib.decompress(res["body"], zlib.MAX_WBITS | 16).decode() == body
+    assert app.compression_cache.info()["misses"] == 1
+    assert app.compression_cache.info()["bytes"] == len(res["body"])
+
+    # Same body from another route
+    event["path"] = "/b"
+    assert app(event, {}) == res
+    assert app.compression_cache.info()["hits"] == 1
+
+    # Other level and codec
+    event["path"] = "/c"
+    assert app(event, {})["body"] != res["body"]
+    event = {"path": "/a", "httpMethod": "GET", "headers": {}}
+    event["headers"] = {"Accept-Encoding": "deflate"}
+    assert app(event, {})["headers"]["Content-Encoding"] == "deflate"
+    assert app.compression_cache.info()["misses"] == 3
+    assert len(app.compression_cache) == 3
+
+    app.register_codec("gzip", lambda body, level: b"")
+    assert not len(app.compression_cache)
+
+    assert proxy.API(name="test").compression_cache is None
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_parallelCompression():
+    """Should compress large bodies on a thread pool."""
+    body = json.dumps({"values": list(range(100000))})
+
+    app = proxy.API(
+        name="test", parallel_compression_min_size=100000, compression_workers=2
+    )
+    funct = Mock(__name__="Mock", return_value=("OK", "application/json", body))
+    app._add_route("/large", funct, payload_compression_method="gzip")
+    small = Mock(__name__="Mock", return_value=("OK", "application/json", "{}"))
+    app._add_route("/small", small, payload_compression_method="gzip")
+
+    event = {"path": "/small", "httpMethod": "GET", "headers": {}}
+    event["headers"] = {"Accept-Encoding": "gzip"}
+    app(event, {})
+    assert app._compression_executor is None
+
+    event["path"] = "/large"
+    res = app(event, {})
+    assert zlib.decompress(res["body"], zlib.MAX_WBITS | 16).decode() == body
+    assert app._compression_executor is not None
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+@pytest.mark.parametrize("factory", [bytes, bytearray, memoryview])
+def test_API_binaryBodies(factory):
+    """Should accept bytes, bytearray and memoryview bodies."""
+    body = b"thisisafakeencodedpbf" * 10
+
+    app = proxy.API(name="test")
+    funct = Mock(
+        __name__="Mock",
+        return_value=("OK", "application/x-protobuf", factory(body)),
+    )
+    app._add_route("/b64", funct, binary_b64encode=True)
+    app._add_route("/raw", funct)
+    app._add_route(
+        "/gzip", funct, binary_b64encode=True, payload_compression_method="gzip"
+    )
+
+    event = {"path": "/b64", "httpMethod": "GET", "headers": {}}
+    res = app(event, {})
+    assert res["isBase64Encoded"]
+    assert res["body"] == base64.b64encode(body).decode()
+
+    event["path"] = "/raw"
+    assert app(event, {})["body"] == body
+
+    event["path"] = "/gzip"
+    event["headers"] = {"Accept-Encoding": "gzip"}
+    res = app(event, {})
+    data = base64.b64decode(res["body"])
+    assert zlib.decompress(data, zlib.MAX_WBITS | 16) == body
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_as_buffer():
+    """Should return flat bytes memoryview."""
+    values = array.array("i", [1, 2, 3])
+    view = proxy._as_buffer(values)
+    assert view.format == "B"
+    assert view.nbytes == len(view) == values.itemsize * 3
+    assert view.tobytes() == values.tobytes()
+
+    view = proxy._as_buffer(memoryview(b"abcdef")[::2])
+    assert view.tobytes() == b"ace"
+
+    assert proxy._b64encode("heyyyy") == base64.b64encode(b"heyyyy").decode()
+
+
+def test_API_traceAllocations():
+    """Should record route peak memory allocation."""
+    app = proxy.API(name="test", trace_allocations=True)
+    funct = Mock(
+        __name__="Mock",
+        return_value=("OK", "application/octet-stream", bytes(1024 * 1024)),
+    )
+    app._add_route("/test", funct, binary_b64encode=True)
+
+    event = {"path": "/test", "httpMethod": "GET", "headers": {}}
+    app(event, {})
+    route = app.routes[-1]
+    # base64 bytes and string, at least
+    assert route.peak_allocation > 2 * 1024 * 1024
+    assert proxy.RouteEntry(funct, "/other").peak_allocation == 0
+    tracemalloc.stop()
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_maxResponseSize():
+    """Should guard against oversized responses."""
+    body = json.dumps({"values": list(range(10000))})
+    assert proxy.API(name="test").max_response_size == 6 * 1024 * 1024
+
+    app = proxy.API(name="test", max_response_size=30000)
+    funct = Mock(__name__="Mock", return_value=("OK", "application/json", body))
+    app._add_route(
+        "/compressed", funct, payload_compression_method="gzip", compression_level=0
+    )
+    app._add_route("/raw", funct)
+    small = Mock(__name__="Mock", return_value=("OK", "application/json", body[:100]))
+    app._add_route("/small", small)
+
+    # Compressed again with the highest level
+    event = {"path": "/compressed", "httpMethod": "GET", "headers": {}}
+    event["headers"] = {"Accept-Encoding": "gzip"}
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert zlib.decompress(res["body"], zlib.MAX_WBITS | 16).decode() == body
+    route = app.routes[-3]
+    assert route.peak_response_size == proxy._get_response_size(res)
+    assert not route.oversized_responses
+
+    # Uncompressed
+    event["headers"] = {}
+    res = app(event, {})
+    assert res["statusCode"] == 502
+    error = json.loads(res["body"])
+    assert error["limit"] == 30000
+    assert error["size"] > 30000
+    assert route.oversized_responses == 1
+    assert route.peak_response_size == error["size"]
+
+    event["path"] = "/raw"
+    assert app(event, {})["statusCode"] == 502
+    assert app.routes[-2].oversized_responses == 1
+
+    event["path"] = "/small"
+    assert app(event, {})["statusCode"] == 200
+    assert app.routes[-1].peak_response_size < 30000
+    assert not app.routes[-1].oversized_responses
+
+    # Disabled
+    app = proxy.API(name="test", max_response_size=0)
+    app._add_route("/raw", funct)
+    event["path"] = "/raw"
+    assert app(event, {})["statusCode"] == 200
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_get_response_size():
+    """Should return approximate serialized response size."""
+    message = {"statusCode": 200, "headers": {"Content-Type": "text/plain"}}
+    assert proxy._get_response_size(dict(message, body="")) == 64 + 28
+    assert proxy._get_response_size(dict(message, body="heyyyy")) == 64 + 28 + 6
+    assert proxy._get_response_size(dict(message, body='"a"\\')) == 64 + 28 + 7
+    assert proxy._get_response_size(dict(message, body="a\nb")) == 64 + 28 + 4
+    # non ASCII characters are escaped (`\u00e9`)
+    assert proxy._get_response_size(dict(message, body="é" * 800)) == 64 + 28 + 4800
+    assert proxy._get_response_size(dict(message, body=b"\x00" * 10)) == 64 + 28 + 10
+    b64 = dict(message, body="aGV5eXl5", isBase64Encoded=True)
+    assert proxy._get_response_size(b64) == 64 + 28 + 8
+
+    # Characters escaped with 2, 6 and 12 bytes
+    body = 'a"\\\n\x01\x7fé中😀\ud800'
+    size = len(json.dumps(body)) - 2
+    assert proxy._get_response_size(dict(message, body=body)) == 64 + 28 + size
+
+    # Text which can't exceed the threshold is measured by its length
+    body = "é" * 800
+    assert proxy._get_response_size(dict(message, body=body), 10000) == 64 + 28 + 800
+    assert proxy._get_response_size(dict(message, body=body), 1000) == 64 + 28 + 4800
+
+
+def test_API_maxResponseSizeText():
+    """Should measure serialized text responses size."""
+    app = proxy.API(name="test", max_response_size=1000)
+
+    @app.get("/text")
+    def _text() -> Tuple[str, str, str]:
+        """Return something."""
+        return ("OK", "text/plain", "é" * 800)
+
+    event = {
+        "path": "/text",
+        "httpMethod": "GET",
+        "headers": {},
+        "queryStringParameters": {},
+    }
+    res = app(event, {})
+    assert res["statusCode"] == 502
+    assert json.loads(res["body"])["size"] > 4800
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_asyncEndpoint():
+    """Should run async endpoints on a reused event loop."""
+    app = proxy.API(name="test")
+    loops = []
+
+    async def fetch(value):
+        await asyncio.sleep(0.01)
+        loops.append(asyncio.get_running_loop())
+        return value
+
+    @app.get("/test/<user>")
+    async def test(user: str, count: int = 2):
+        values = await asyncio.gather(*[fetch(f"{user}{i}") for i in range(count)])
+        return ("OK", "text/plain", ",".join(values))
+
+    @app.get("/event")
+    @app.pass_event
+    async def event_path(event):
+        return ("OK", "text/plain", event["path"])
+
+    @app.get("/error")
+    async def error():
+        raise Exception("async error")
+
+    assert app.routes[-3].is_async
+    assert app.routes[-2].is_async
+
+    event = {"path": "/test/remotepixel", "httpMethod": "GET", "headers": {}}
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert res["body"] == "remotepixel0,remotepixel1"
+
+    event["queryStringParameters"] = {"count": "3"}
+    assert app(event, {})["body"] == "remotepixel0,remotepixel1,remotepixel2"
+    assert len(loops) == 5
+    assert all(loop is app.event_loop for loop in loops)
+
+    event = {"path": "/event", "httpMethod": "GET", "headers": {}}
+    assert app(event, {})["body"] == "/event"
+
+    event = {"path": "/error", "httpMethod": "GET", "headers": {}}
+    res = app(event, {})
+    assert res["statusCode"] == 500
+    assert json.loads(res["body"]) == {"errorMessage": "async error"}
+
+    # Sync callables returning a coroutine
+    def decorator(func):
+        def wrapper(**kwargs):
+            return func(**kwargs)
+
+        return wrapper
+
+    @app.get("/decorated/<user>")
+    @decorator
+    async def decorated(user: str):
+        return ("OK", "text/plain", user)
+
+    assert not app.routes[-1].is_async
+    event = {"path": "/decorated/remotepixel", "httpMethod": "GET", "headers": {}}
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert res["body"] == "remotepixel"
+
+    # Sync endpoints don't start an event loop
+    app = proxy.API(name="test")
+    funct = Mock(__name__="Mock", return_value=("OK", "text/plain", "heyyyy"))
+    app._add_route("/sync", funct)
+    assert not app.routes[-1].is_async
+    app({"path": "/sync", "httpMethod": "GET", "headers": {}}, {})
+    assert app._event_loop is None
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_concurrentRequests():
+    """Should keep request state isolated between threads."""
+    app = proxy.API(name="test")
+    barrier = threading.Barrier(4)
+
+    @app.get("/sync/<user>")
+    @app.pass_event
+    def sync_user(event, user):
+        barrier.wait(timeout=5)
+        return ("OK", "text/plain", f"{user}:{event['path']}:{app.host}")
+
+    @app.get("/async/<user>")
+    @app.pass_event
+    async def async_user(event, user):
+        await asyncio.sleep(0.01)
+        return ("OK", "text/plain", f"{user}:{event['path']}:{app.host}")
+
+    def call(path, user):
+        event = {
+            "path": f"/{path}/{user}",
+            "httpMethod": "GET",
+            "headers": {"Host": f"{user}.com"},
+        }
+        return app(event, {})["body"]
+
+    for path in ["sync", "async"]:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            users = [f"user{i}" for i in range(4)]
+            responses = list(executor.map(lambda user: call(path, user), users))
+
+        assert responses == [
+            f"{user}:/{path}/{user}:https://{user}.com" for user in users
+        ]
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_API_handleBatch(executor):
+    """Should handle events concurrently and return responses in order."""
+    app = proxy.API(name="test", router="alternation")
+
+    @app.get("/users/<int:user>")
+    def user(user):
+        return ("OK", "text/plain", str(user * 2))
+
+    @app.get("/async/<int:user>")
+    async def async_user(user):
+        await asyncio.sleep(0)
+        return ("OK", "text/plain", str(user * 3))
+
+    @app.get("/error")
+    def error():
+        raise Exception("oops")
+
+    events = [
+        {"path": f"/users/{i}", "httpMethod": "GET", "headers": {}} for i in range(20)
+    ]
+    events += [
+        {"path": f"/async/{i}", "httpMethod": "GET", "headers": {}} for i in range(5)
+    ]
+    events.append({"path": "/error", "httpMethod": "GET", "headers": {}})
+
+    responses, stats = app.handle_batch(events, {}, workers=2, executor=executor)
+    assert [res["body"] for res in responses[:25]] == [
+        str(i * 2) for i in range(20)
+    ] + [str(i * 3) for i in range(5)]
+    assert responses[-1]["statusCode"] == 500
+    assert stats["count"] == 26
+    assert stats["errors"] == 1
+    assert stats["throughput"] > 0
+    assert stats["executor"] == executor
+    assert stats["workers"] == 2
+    assert proxy._batch_state == (None, None)
+    # No thread is started before forking the workers
+    assert (app._event_loop is None) == (executor == "process")
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_handleBatchSharedEvent(monkeypatch):
+    """Should not modify the events."""
+    monkeypatch.setenv("TOKEN", "yo")
+    app = proxy.API(name="test")
+
+    @app.get("/users/<int:user>", token=True)
+    def user(user):
+        return ("OK", "text/plain", str(user))
+
+    event = {
+        "path": "/users/1",
+        "httpMethod": "GET",
+        "headers": {"Host": "localhost"},
+        "queryStringParameters": {"access_token": "yo"},
+    }
+    responses, stats = app.handle_batch([event] * 200, {}, workers=4)
+    assert stats["errors"] == 0
+    assert set(res["statusCode"] for res in responses) == {200}
+    assert event["headers"] == {"Host": "localhost"}
+    assert event["queryStringParameters"] == {"access_token": "yo"}
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_init_batch_worker():
+    """Should reset held locks in forked workers."""
+    app = proxy.API(name="test", route_cache_size=10, compression_cache_size=1024)
+    funct = Mock(__name__="Mock", return_value=("OK", "text/plain", "heyyyy"))
+    cache = ResponseCache(ttl=10, backend=TieredCache())
+    app._add_route("/test", funct, cache=cache)
+
+    locks = [
+        app.route_cache._lock,
+        app.compression_cache._lock,
+        cache.backend.memory._lock,
+        cache.backend.disk._lock,
+    ]
+    for lock in locks:
+        lock.acquire()
+
+    try:
+        proxy._init_batch_worker(app, None)
+        assert proxy._batch_state == (app, None)
+    finally:
+        proxy._batch_state = (None, None)
+
+    assert not app.route_cache._lock.locked()
+    assert not app.compression_cache._lock.locked()
+    assert not cache.backend.memory._lock.locked()
+    assert not cache.backend.disk._lock.locked()
+
+    for lock in locks:
+        lock.release()
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+def test_API_handleBatchInvalidExecutor():
+    """Should raise ValueError for unsupported executor."""
+    app = proxy.API(name="test")
+    with pytest.raises(ValueError):
+        app.handle_batch([], executor="cluster")
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+@pytest.mark.parametrize("workers", [0, 4])
+def test_API_batchRoute(workers):
+    """Should handle sub-requests in one request."""
+    app = proxy.API(name="test")
+    app.setup_batch(workers=workers, max_requests=5, payload_compression_method="gzip")
+
+    @app.get("/users/<user>")
+    def user(user: str, size: int = 1):
+        return ("OK", "text/plain", user * size)
+
+    @app.route("/users", methods=["POST"])
+    def create_user(body):
+        return ("OK", "application/json", body)
+
+    @app.get("/tile.png")
+    def tile():
+        return ("OK", "image/png", b"png")
+
+    requests = [
+        {"path": "/users/remotepixel", "query": {"size": "2"}},
+        {"method": "post", "path": "/users", "body": {"name": "vincent"}},
+        {"path": "/tile.png"},
+        {"path": "/nope"},
+        {"query": {}},
+    ]
+    event = {
+        "path": "/batch",
+        "httpMethod": "POST",
+        "headers": {"Accept-Encoding": "gzip"},
+        "body": json.dumps(requests),
+    }
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert res["headers"]["Content-Encoding"] == "gzip"
+
+    responses = json.loads(zlib.decompress(res["body"], zlib.MAX_WBITS | 16))
+    assert [r["statusCode"] for r in responses] == [200, 200, 200, 400, 400]
+    assert responses[0]["body"] == "remotepixelremotepixel"
+    assert not responses[0]["headers"].get("Content-Encoding")
+    assert json.loads(responses[1]["body"]) == {"name": "vincent"}
+    assert responses[2]["isBase64Encoded"]
+    assert base64.b64decode(responses[2]["body"]) == b"png"
+
+    # Invalid batch requests
+    event = {"path": "/batch", "httpMethod": "POST", "headers": {}}
+    for body in ["", "{}", "notjson", json.dumps([{"path": "/users/a"}] * 6)]:
+        event["body"] = body
+        assert app(event, {})["statusCode"] == 400
+
+    event["body"] = json.dumps([{"path": "/batch"}])
+    res = app(event, {})
+    assert json.loads(res["body"])[0]["statusCode"] == 400
+
+    # Conditional headers are not passed to sub-requests
+    @app.get("/etag", etag=True)
+    def _etag():
+        return ("OK", "text/plain", "heyyyy")
+
+    event["headers"] = {"If-None-Match": proxy._get_etag("heyyyy")}
+    event["body"] = json.dumps([{"path": "/etag"}])
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    sub_response = json.loads(res["body"])[0]
+    assert sub_response["statusCode"] == 200
+    assert sub_response["body"] == "heyyyy"
+    event["headers"] = {}
+
+    # Invalid sub-requests only fail themselves
+    event["body"] = json.dumps(
+        [
+            {"path": "/users/a", "method": 1},
+            {"path": "/users/a", "query": ["a"]},
+            {"path": "/users/a", "query": {"size": {"a": 1}}},
+            {"path": "/users/a", "query": {"size": 2}},
+        ]
+    )
+    res = app(event, {})
+    assert res["statusCode"] == 200
+    assert [r["statusCode"] for r in json.loads(res["body"])] == [400, 400, 400, 200]
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
@@ -0,0 +1,195 @@
+"""tests lambda_proxy.server."""
+
+import json
+import time
+import socket
+import threading
+from http.client import HTTPConnection
+
+import pytest
+
+from lambda_proxy import proxy, server
+
+
+@pytest.fixture
+def app():
+    """Create API."""
+    app = proxy.API(name="test", add_docs=False)
+
+    @app.route("/users/<user>", methods=["GET", "PUT", "DELETE", "PATCH"])
+    @app.pass_event
+    def user(event, user: str, size: int = 1, body=None):
+        return (
+            "OK",
+            "application/json",
+            json.dumps(
+                {
+                    "user": user * size,
+                    "method": event["httpMethod"],
+                    "body": body,
+                }
+            ),
+        )
+
+    @app.get("/image.png", binary_b64encode=True)
+    def image():
+        return ("OK", "image/png", b"\x89PNG")
+
+    yield app
+
+    # Clear logger handlers
+    for h in app.log.handlers:
+        app.log.removeHandler(h)
+
+
+@pytest.fixture
+def local_server(app, request):
+    """Start a local server."""
+    options = getattr(request, "param", {})
+    httpd = server.ThreadPoolHTTPServer(("127.0.0.1", 0), app, **options)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_get_event():
+    """Should create API Gateway events."""
+    headers = [("Host", "localhost"), ("Cookie", "a=1; b=2"), ("X-Value", "1")]
+    headers.append(("X-Value", "2"))
+
+    event = server.get_event("POST", "/users/a?size=2&size=3&b=", headers, b"yo")
+    assert event["httpMethod"] == "POST"
+    assert event["path"] == "/users/a"
+    assert event["pathParameters"] == {"proxy": "users/a"}
+    assert event["queryStringParameters"] == {"size": "3", "b": ""}
+    assert event["multiValueQueryStringParameters"] == {"size": ["2", "3"], "b": [""]}
+    assert event["headers"]["X-Value"] == "2"
+    assert event["multiValueHeaders"]["X-Value"] == ["1", "2"]
+    assert event["body"] == "eW8="
+    assert event["isBase64Encoded"]
+
+    event = server.get_event("GET", "/users/a?size=2&size=3", headers, version="2.0")
+    assert event["version"] == "2.0"
+    assert event["rawPath"] == "/users/a"
+    assert event["rawQueryString"] == "size=2&size=3"
+    assert event["queryStringParameters"] == {"size": "2,3"}
+    assert event["requestContext"]["http"]["method"] == "GET"
+    assert event["headers"] == {"host": "localhost", "x-value": "1,2"}
+    assert event["cookies"] == ["a=1", "b=2"]
+    assert event["body"] is None
+    assert not event["isBase64Encoded"]
+
+    with pytest.raises(ValueError):
+        server.get_event("GET", "/", [], version="3.0")
+
+
+@pytest.mark.parametrize(
+    "local_server", [{"event_version": "1.0"}, {"event_version": "2.0"}], indirect=True
+)
+def test_server(local_server):
+    """Should serve API with keep-alive connections."""
+    host, port = local_server.server_address
+    conn = HTTPConnection(host, port, timeout=5)
+
+    conn.request("GET", "/users/remotepixel?size=2")
+    res = conn.getresponse()
+    assert res.status == 200
+    assert res.version == 11
+    assert json.loads(res.read()) == {
+        "user": "remotepixelremotepixel",
+        "method": "GET",
+        "body": None,
+    }
+    sock = conn.sock
+
+    for method in ["PUT", "PATCH", "DELETE"]:
+        conn.request(method, "/users/remotepixel", body=b"data")
+        res = conn.getresponse()
+        assert res.status == 200
+        assert json.loads(res.read())["method"] == method
+
+    # Same connection
+    assert conn.sock is sock
+
+    conn.request("GET", "/image.png")
+    res = conn.getresponse()
+    assert res.getheader("Content-Type") == "image/png"
+    assert res.read() == b"\x89PNG"
+
+    conn.request("HEAD", "/users/remotepixel")
+    res = conn.getresponse()
+    assert res.read() == b""
+
+    conn.request("POST", "/users/remotepixel")
+    res = conn.getresponse()
+    assert res.status == 405
+    res.read()
+
+    conn.request("GET", "/nope")
+    res = conn.getresponse()
+    assert res.status == 400
+    res.read()
+    conn.close()
+
+
+@pytest.mark.parametrize(
+    "local_server", [{"workers": 1, "queue_size": 1}], indirect=True
+)
+def test_server_queueFull(local_server):
+    """Should reject connections when the queue is full."""
+    host, port = local_server.server_address
+
+    # A partial request occupies the worker, another connection the queue
+    busy = socket.create_connection((host, port))
+    busy.sendall(b"GET /users/a HTTP/1.1\r\n")
+    time.sleep(0.2)
+    waiting = socket.create_connection((host, port))
+    time.sleep(0.2)
+
+    conn = HTTPConnection(host, port, timeout=5)
+    conn.request("GET", "/users/a")
+    assert conn.getresponse().status == 503
+    conn.close()
+
+    busy.close()
+    waiting.close()
+
+
+@pytest.mark.parametrize(
+    "local_server", [{"workers": 1, "keep_alive_timeout": 0.5}], indirect=True
+)
+def test_server_keepAlive(local_server):
+    """Should not hold workers with idle keep-alive connections."""
+    host, port = local_server.server_address
+
+    conns = [HTTPConnection(host, port, timeout=2) for _ in range(3)]
+    for _ in range(2):
+        for conn in conns:
+            conn.request("GET", "/users/a")
+            res = conn.getresponse()
+            assert res.status == 200
+            res.read()
+
+    # Pipelined requests
+    sock = socket.create_connection((host, port), timeout=2)
+    sock.sendall(b"GET /users/a HTTP/1.1\r\nHost: a\r\n\r\n" * 2)
+
+    # Idle connections are closed after the keep-alive timeout
+    time.sleep(1.5)
+    data = b""
+    chunk = sock.recv(4096)
+    while chunk:
+        data += chunk
+        chunk = sock.recv(4096)
+    assert data.count(b"HTTP/1.1 200") == 2
+    sock.close()
+    for conn in conns:
+        conn.close()
+
+
+def test_server_invalidVersion(app):
+    """Should raise ValueError for unsupported event version."""
+    with pytest.raises(ValueError):
+        server.ThreadPoolHTTPServer(("127.0.0.1", 0), app, event_version="3.0")